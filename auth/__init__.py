@@ -5,24 +5,25 @@ from fastapi.params import Depends
 from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from type.user import Login, SignUp, User
 
-from db import get_collection
-from util.jwt import create_access_token, verify_access_token
-from util.security import hash_password, verify_hash
+from db import get_async_collection
+from util.jwt import create_access_token, revoke_access_token, verify_access_token
+from util.security import hash_password_async, invalidate_access, verify_and_rehash_async
 from util.key import generate_user_key, key_validiator
+from util.ratelimit import admission
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 api_key_scheme = APIKeyHeader(name="X-API-Key")
 
-@router.post("/signup")
+@router.post("/signup", dependencies=[Depends(admission("auth"))])
 async def create_user(user: SignUp):
-    users = get_collection("users")
+    users = get_async_collection("users")
 
-    if users.find_one({"email": user.email}):
+    if await users.find_one({"email": user.email}, {"_id": 1}):
         raise HTTPException(status_code=409, detail="User already exists.")
 
     user_dict = user.model_dump()
-    hassedPassword = hash_password(user_dict["password"])
+    hassedPassword = await hash_password_async(user_dict["password"])
     time = datetime.now(timezone.utc)
 
     new_User = User(
@@ -36,7 +37,7 @@ async def create_user(user: SignUp):
         key=generate_user_key(),
     )
 
-    result = users.insert_one(new_User.model_dump(exclude={"id"}))
+    result = await users.insert_one(new_User.model_dump(exclude={"id"}))
     return {
         "key": new_User.key,
         "id": str(result.inserted_id),
@@ -44,18 +45,30 @@ async def create_user(user: SignUp):
     }
 
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(admission("auth"))])
 async def login(user: Login, key: str = Depends(api_key_scheme)):
-    if not key_validiator(key):
+    if not await key_validiator(key):
         raise HTTPException(status_code=401, detail="Unauthorized access.")
 
-    users = get_collection("users")
-    raw_user = users.find_one({"email": user.email})
+    users = get_async_collection("users")
+    raw_user = await users.find_one({"email": user.email})
     if not raw_user:
         raise HTTPException(status_code=401, detail="Invalid credentials.")
     db_user = User(id=str(raw_user["_id"]), **raw_user)
-    if not verify_hash(user.password, db_user.password_hash):
+    verified, new_hash = await verify_and_rehash_async(user.password, db_user.password_hash)
+    if not verified:
         raise HTTPException(status_code=401, detail="Invalid credentials.")
+    if new_hash:
+        # Move the stored hash to the configured BCRYPT_ROUNDS, unless the
+        # password was changed in the meantime
+        await users.update_one(
+            {"_id": raw_user["_id"], "password_hash": db_user.password_hash},
+            {"$set": {"password_hash": new_hash}},
+        )
+    if not db_user.is_active:
+        raise HTTPException(
+            status_code=403, detail="User is deactivated, reactivate it through /users/reactivate."
+        )
     if db_user.is_logged_in:
         raise HTTPException(status_code=400, detail="User already logged in.")
     
@@ -67,7 +80,7 @@ async def login(user: Login, key: str = Depends(api_key_scheme)):
             "email": db_user.email,
         }
     )
-    result = users.update_one(
+    result = await users.update_one(
         {"_id": raw_user["_id"]},
         {"$set": {"last_login": datetime.now(timezone.utc), "is_logged_in": True}},
     )
@@ -82,18 +95,12 @@ async def login(user: Login, key: str = Depends(api_key_scheme)):
 @router.post("/logout")
 async def logout(token: str = Depends(oauth2_scheme), key: str = Depends(api_key_scheme)):
     print(token, "\n", key)
-    if not key_validiator(key):
+    if not await key_validiator(key):
         raise HTTPException(status_code=401, detail="Unauthorized access.")
     
-    payload = verify_access_token(token)
-    users = get_collection("users")
-    blacklisted = get_collection("blacklisted_tokens")
-    users.update_one({"_id": ObjectId(payload["sub"])}, {"$set": {"is_logged_in": False}})
-    blacklisted.insert_one(
-        {
-            "token": token,
-            "user_id": payload["sub"],
-            "revoked_at": datetime.now(timezone.utc),
-        }
-    )
+    payload = await verify_access_token(token)
+    users = get_async_collection("users")
+    await users.update_one({"_id": ObjectId(payload["sub"])}, {"$set": {"is_logged_in": False}})
+    await revoke_access_token(payload, token)
+    invalidate_access(token, key)
     return {"message": "User logged out successfully"}
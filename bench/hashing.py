@@ -0,0 +1,59 @@
+import argparse
+import os
+import statistics
+import time
+
+from passlib.context import CryptContext
+
+from util import _get_env
+
+# Same defaults as util.security, which needs the database settings to import
+BCRYPT_ROUNDS = int(_get_env("BCRYPT_ROUNDS", required=False, default="12"))
+HASH_POOL_SIZE = int(
+    _get_env("HASH_POOL_SIZE", required=False, default=str(os.cpu_count() or 1))
+)
+
+_context = CryptContext(schemes=["bcrypt"])
+
+
+def _verify_seconds(rounds: int, samples: int) -> float:
+    context = _context.copy(bcrypt__rounds=rounds)
+    hashed = context.hash("calibration-password")
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.verify("calibration-password", hashed)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms: float, samples: int = 5, max_rounds: int = 16) -> int:
+    """
+    Return the highest bcrypt cost whose verify takes at most `target_ms`
+    on this host, never below 10.
+    """
+    best = 10
+    for rounds in range(10, max_rounds + 1):
+        seconds = _verify_seconds(rounds, samples)
+        print(
+            f"rounds={rounds:2d}  verify={seconds * 1000:8.1f} ms  "
+            f"logins/s per worker={HASH_POOL_SIZE / seconds:8.1f}"
+        )
+        if seconds * 1000 > target_ms:
+            break
+        best = rounds
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark bcrypt on this host and suggest BCRYPT_ROUNDS."
+    )
+    parser.add_argument(
+        "--target-ms", type=float, default=250, help="target verify latency per login"
+    )
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    args = parser.parse_args()
+    rounds = calibrate(args.target_ms, args.samples, args.max_rounds)
+    print(f"\nBCRYPT_ROUNDS={rounds}  (currently {BCRYPT_ROUNDS})")
@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+import httpx
+from pymongo import MongoClient
+
+from util import logger
+
+# Relative weight of each operation in the steady-state mix
+MIX = {
+    "GET /notes": 20,
+    "GET /notes/{id}": 20,
+    "POST /notes": 10,
+    "PUT /notes/{id}": 10,
+    "POST /notes/bulk": 3,
+    "PUT /notes/bulk": 3,
+    "POST /notes/share/{id}/{user_id}": 3,
+    "POST /notes/unshare/{id}/{user_id}": 3,
+    "POST /notes/share": 2,
+    "POST /notes/unshare": 2,
+    "DELETE /notes/{id}": 3,
+    "GET /search": 10,
+    "GET /search/suggest": 10,
+    "GET /users": 3,
+}
+
+
+WORDS = ["alpha", "budget", "meeting", "travel", "recipe", "project", "garden", "invoice", "music", "review"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+@contextmanager
+def local_mongod(binary: str):
+    """
+    Start a throwaway mongod on a free port with a temporary data directory.
+    """
+    port = _free_port()
+    dbpath = tempfile.mkdtemp(prefix="bench-mongod-")
+    proc = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for_port(port, 30)
+        yield f"mongodb://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+@contextmanager
+def app_server(db_url: str, db_name: str, workers: int):
+    """
+    Boot main:app through the serve entry point against the given database.
+    """
+    port = _free_port()
+    env = dict(os.environ, DB_URL=db_url, DB_NAME=db_name)
+    env.setdefault("SECRET_KEY", "bench-secret")
+    env.setdefault("ALGORITHM", "HS256")
+    env.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+    # The load generator is one client hammering auth, bulk and search, so
+    # neither its request rate nor its concurrency may be limited
+    for route_class in ("AUTH", "BULK", "SEARCH"):
+        env.setdefault(f"RATE_LIMIT_{route_class}", "0")
+        env.setdefault(f"CONCURRENCY_LIMIT_{route_class}", "0")
+    proc = subprocess.Popen(
+        [
+            sys.executable, "serve.py",
+            "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+        ],
+        env=env,
+    )
+    try:
+        _wait_for_port(port, 60)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def call(self, route: str, request) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for route in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = sorted(recorder.latencies.get(route, []))
+        stats = {"count": len(values), "errors": recorder.errors.get(route, 0)}
+        if values:
+            stats.update(
+                rps=round(len(values) / elapsed, 2),
+                mean_ms=round(sum(values) / len(values) * 1000, 3),
+                p50_ms=round(_percentile(values, 50) * 1000, 3),
+                p95_ms=round(_percentile(values, 95) * 1000, 3),
+                p99_ms=round(_percentile(values, 99) * 1000, 3),
+            )
+        routes[route] = stats
+    return routes
+
+
+class Session:
+    def __init__(self, user_id: str, credentials: dict, key: str, token: str):
+        self.user_id = user_id
+        self.credentials = credentials
+        self.key = key
+        self.headers = {"X-API-Key": key, "Authorization": f"Bearer {token}"}
+        self.note_ids: list[str] = []
+        self.shared: set[tuple[str, str]] = set()
+
+
+async def seed(client: httpx.AsyncClient, recorder: Recorder, users: int, notes: int) -> list[Session]:
+    sessions = []
+    tag = os.urandom(4).hex()
+    for i in range(users):
+        email = f"bench-{tag}-{i}@example.com"
+        body = {"email": email, "password": f"bench-password-{i}"}
+        signup = await recorder.call("POST /signup", client.post("/signup", json=body))
+        key = signup.json()["key"]
+        login = await recorder.call(
+            "POST /login", client.post("/login", json=body, headers={"X-API-Key": key})
+        )
+        session = Session(signup.json()["id"], body, key, login.json()["access_token"])
+        headers = session.headers
+        for start in range(0, notes, 500):
+            batch = [
+                {"title": f"Seed note {n} about {random.choice(WORDS)}", "content": _content()}
+                for n in range(start, min(notes, start + 500))
+            ]
+            response = await client.post("/notes/bulk", json=batch, headers=headers)
+            session.note_ids += response.json()["ids"]
+        sessions.append(session)
+    return sessions
+
+
+# Words per generated note body, set from --content-words
+CONTENT_WORDS = 40
+
+
+def _content() -> str:
+    return " ".join(random.choices(WORDS, k=CONTENT_WORDS))
+
+
+async def _operation(client, recorder: Recorder, sessions: list[Session], route: str) -> None:
+    session = random.choice(sessions)
+    other = random.choice(sessions)
+    headers = session.headers
+    note_id = random.choice(session.note_ids) if session.note_ids else None
+
+    if route == "GET /notes":
+        await recorder.call(route, client.get("/notes", params={"limit": 50}, headers=headers))
+    elif route == "GET /notes/{id}" and note_id:
+        await recorder.call(route, client.get(f"/notes/{note_id}", headers=headers))
+    elif route == "POST /notes":
+        response = await recorder.call(
+            route, client.post("/notes", json={"title": "Load note", "content": _content()}, headers=headers)
+        )
+        if response is not None and response.status_code == 200:
+            session.note_ids.append(response.json()["id"])
+    elif route == "PUT /notes/{id}" and note_id:
+        await recorder.call(
+            route, client.put(f"/notes/{note_id}", json={"content": _content()}, headers=headers)
+        )
+    elif route == "POST /notes/bulk":
+        batch = [{"title": "Bulk note", "content": _content()} for _ in range(20)]
+        response = await recorder.call(route, client.post("/notes/bulk", json=batch, headers=headers))
+        if response is not None and response.status_code == 200:
+            session.note_ids += response.json()["ids"]
+    elif route == "PUT /notes/bulk" and session.note_ids:
+        ids = random.sample(session.note_ids, min(20, len(session.note_ids)))
+        body = [{"title": "Bulk edit"} for _ in ids]
+        await recorder.call(route, client.put("/notes/bulk", params={"ids": ids}, json=body, headers=headers))
+    elif route == "POST /notes/share/{id}/{user_id}" and note_id and other is not session:
+        if (note_id, other.user_id) in session.shared:
+            return
+        session.shared.add((note_id, other.user_id))
+        await recorder.call(route, client.post(f"/notes/share/{note_id}/{other.user_id}", headers=headers))
+    elif route == "POST /notes/unshare/{id}/{user_id}" and session.shared:
+        note_id, user_id = session.shared.pop()
+        await recorder.call(route, client.post(f"/notes/unshare/{note_id}/{user_id}", headers=headers))
+    elif route == "POST /notes/share" and session.note_ids and other is not session:
+        ids = random.sample(session.note_ids, min(10, len(session.note_ids)))
+        session.shared.update((id, other.user_id) for id in ids)
+        body = {"note_ids": ids, "user_ids": [other.user_id]}
+        await recorder.call(route, client.post("/notes/share", json=body, headers=headers))
+    elif route == "POST /notes/unshare" and session.shared:
+        user_id = random.choice(list(session.shared))[1]
+        ids = [id for id, member in session.shared if member == user_id][:10]
+        session.shared.difference_update((id, user_id) for id in ids)
+        body = {"note_ids": ids, "user_ids": [user_id]}
+        await recorder.call(route, client.post("/notes/unshare", json=body, headers=headers))
+    elif route == "DELETE /notes/{id}" and note_id:
+        session.note_ids.remove(note_id)
+        session.shared = {pair for pair in session.shared if pair[0] != note_id}
+        await recorder.call(route, client.delete(f"/notes/{note_id}", headers=headers))
+    elif route == "GET /search":
+        await recorder.call(route, client.get("/search/", params={"q": random.choice(WORDS)}, headers=headers))
+    elif route == "GET /search/suggest":
+        prefix = random.choice(["se", "seed", "lo", "bu"])
+        await recorder.call(route, client.get("/search/suggest", params={"prefix": prefix}, headers=headers))
+    elif route == "GET /users":
+        await recorder.call(route, client.get("/users", headers=headers))
+
+
+async def run_load(base_url: str, args) -> dict:
+    global CONTENT_WORDS
+    CONTENT_WORDS = args.content_words
+    random.seed(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        seed_recorder = Recorder()
+        logger.info("Seeding %d users with %d notes each...", args.users, args.notes)
+        sessions = await seed(client, seed_recorder, args.users, args.notes)
+
+        recorder = Recorder()
+        routes, weights = zip(*MIX.items())
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                route = random.choices(routes, weights)[0]
+                await _operation(client, recorder, sessions, route)
+
+        logger.info("Running mix for %.0fs at concurrency %d...", args.duration, args.concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        # Each user logs out and back in once so the auth routes get more samples
+        for session in sessions:
+            await seed_recorder.call("POST /logout", client.post("/logout", headers=session.headers))
+            await seed_recorder.call(
+                "POST /login",
+                client.post("/login", json=session.credentials, headers={"X-API-Key": session.key}),
+            )
+
+    routes = summarize(recorder, elapsed)
+    for route, stats in summarize(seed_recorder, elapsed).items():
+        stats.pop("rps", None)
+        routes[route] = stats
+    total = sum(stats["count"] for route, stats in routes.items() if route in MIX)
+    return {
+        "meta": {
+            "users": args.users,
+            "notes_per_user": args.notes,
+            "content_words": args.content_words,
+            "concurrency": args.concurrency,
+            "duration_s": round(elapsed, 3),
+            "workers": args.workers,
+        },
+        "total_rps": round(total / elapsed, 2),
+        "routes": routes,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    List every route whose p95 latency grew or throughput fell by more than
+    `tolerance` (a fraction) compared with the baseline report.
+    """
+    regressions = []
+    for route, old in baseline.get("routes", {}).items():
+        new = report["routes"].get(route)
+        if not new or "p95_ms" not in new or "p95_ms" not in old:
+            continue
+        if new["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+        if "rps" in old and new.get("rps", 0) < old["rps"] * (1 - tolerance):
+            regressions.append(f"{route}: rps {old['rps']} -> {new.get('rps', 0)}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for every endpoint.")
+    parser.add_argument("--url", help="benchmark an already running server instead of booting one")
+    parser.add_argument("--db-url", help="MongoDB to boot the app against (default: start a local mongod)")
+    parser.add_argument("--mongod", default="mongod", help="mongod binary used when --db-url is not set")
+    parser.add_argument("--workers", type=int, default=1, help="workers for the booted app, 0 for one per CPU")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--notes", type=int, default=200, help="notes seeded per user")
+    parser.add_argument("--content-words", type=int, default=40, help="words per note body")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady-state load")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    if args.url:
+        report = asyncio.run(run_load(args.url, args))
+    else:
+        db_name = f"bench_{int(time.time())}"
+        with nullcontext(args.db_url) if args.db_url else local_mongod(args.mongod) as db_url:
+            with app_server(db_url, db_name, args.workers) as base_url:
+                report = asyncio.run(run_load(base_url, args))
+            if args.db_url:
+                client = MongoClient(db_url)
+                client.drop_database(db_name)
+                client.close()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            logger.error("Regression: %s", line)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import json
+import timeit
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from type.notes import Note, NoteListAdapter
+from util.response import dumps
+
+
+def _docs(count: int, content_size: int) -> list[dict]:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": str(ObjectId()),
+            "title": f"Note {i}",
+            "content": "x" * content_size,
+            "created_at": now,
+            "updated_at": now,
+            "shared": [str(ObjectId()) for _ in range(i % 4)],
+        }
+        for i in range(count)
+    ]
+
+
+def old_path(docs: list[dict]) -> bytes:
+    # One model per document, then FastAPI's jsonable_encoder and json.dumps
+    result = []
+    for doc in docs:
+        note = dict(doc)
+        note["id"] = str(note.pop("_id"))
+        result.append(Note(**note))
+    return json.dumps(jsonable_encoder(result)).encode()
+
+
+def new_path(docs: list[dict]) -> bytes:
+    notes = []
+    for doc in docs:
+        note = dict(doc)
+        note["id"] = str(note.pop("_id"))
+        notes.append(note)
+    return NoteListAdapter.dump_json(NoteListAdapter.validate_python(notes))
+
+
+def stream_path(docs: list[dict]) -> bytes:
+    return b"".join(dumps({"id": str(doc["_id"]), **doc}) + b"\n" for doc in docs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Note serialization micro-benchmark.")
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--content-size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    docs = _docs(args.notes, args.content_size)
+    results = {}
+    for name, func in [("models+jsonable_encoder", old_path), ("type_adapter", new_path), ("orjson_ndjson", stream_path)]:
+        best = min(timeit.repeat(lambda: func(docs), number=1, repeat=args.repeat))
+        results[name] = best * 1000 * 1000 / args.notes
+
+    baseline = results["models+jsonable_encoder"]
+    for name, ms in results.items():
+        print(f"{name:<26} {ms:8.2f} ms per 1k notes  ({baseline / ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import random
+import timeit
+
+import bson
+
+from db import content
+from bench.load import WORDS
+
+
+def _text(size: int) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def _stored(text: str, codec: str) -> dict:
+    # The inline forms content.encode_content() produces, without GridFS
+    if codec == "plain":
+        return {"content": text}
+    return {"content": bson.Binary(content.compress(text.encode(), codec)), "content_codec": codec}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Note content storage size and codec latency.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 4096, 65536, 1048576])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    codecs = ["plain", "zlib"]
+    if content.zstandard is not None:
+        codecs.append("zstd")
+
+    print(f"{'size':>9} {'codec':<6} {'bson bytes':>11} {'ratio':>6} {'encode us':>10} {'decode us':>10}")
+    for size in args.sizes:
+        text = _text(size)
+        plain = len(bson.encode({"content": text}))
+        for codec in codecs:
+            doc = _stored(text, codec)
+            stored = len(bson.encode(doc))
+            if codec == "plain":
+                encode = decode = 0.0
+            else:
+                raw = text.encode()
+                data = bytes(doc["content"])
+                encode = min(timeit.repeat(lambda: content.compress(raw, codec), number=1, repeat=args.repeat))
+                decode = min(
+                    timeit.repeat(lambda: content.decompress(data, codec).decode(), number=1, repeat=args.repeat)
+                )
+            print(
+                f"{size:>9} {codec:<6} {stored:>11} {plain / stored:>5.1f}x "
+                f"{encode * 1e6:>10.1f} {decode * 1e6:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
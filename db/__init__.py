@@ -1,14 +1,15 @@
-import sys
-import time
-import atexit
+import asyncio
+import os
 from typing import Optional
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 from pymongo.errors import PyMongoError
+from pymongo.read_preferences import ReadPreference
 from pymongo.server_api import ServerApi
 from type.db import CollectionName
 
 from dotenv import load_dotenv
 from util import _get_env, logger
+from util.metrics import command_metrics, pool_metrics
 
 # Load .env early
 load_dotenv()
@@ -16,88 +17,133 @@ load_dotenv()
 MONGO_DB_URL = _get_env("DB_URL")
 MONGO_DB_NAME = _get_env("DB_NAME")
 
-# ---------- Mongo client setup with retry ----------
-_client: Optional[MongoClient] = None
-
-
-def create_mongo_client(
+# ---------- Pool settings ----------
+DB_MAX_POOL_SIZE = int(_get_env("DB_MAX_POOL_SIZE", required=False, default="100"))
+DB_MIN_POOL_SIZE = int(_get_env("DB_MIN_POOL_SIZE", required=False, default="0"))
+# 0 keeps idle connections open forever
+DB_MAX_IDLE_TIME_MS = int(_get_env("DB_MAX_IDLE_TIME_MS", required=False, default="0"))
+# 0 waits for a free connection forever
+DB_WAIT_QUEUE_TIMEOUT_MS = int(
+    _get_env("DB_WAIT_QUEUE_TIMEOUT_MS", required=False, default="0")
+)
+# Comma separated, e.g. "zstd,snappy,zlib"; empty disables compression
+DB_COMPRESSORS = _get_env("DB_COMPRESSORS", required=False, default="")
+# Used only by read-only routes, writes and auth always go to the primary
+DB_READ_PREFERENCE = _get_env("DB_READ_PREFERENCE", required=False, default="primary")
+DB_CONNECT_RETRIES = int(_get_env("DB_CONNECT_RETRIES", required=False, default="3"))
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+if DB_READ_PREFERENCE not in _READ_PREFERENCES:
+    raise ValueError(f"Unknown DB_READ_PREFERENCE: {DB_READ_PREFERENCE}")
+
+
+def pool_options() -> dict:
+    options = {
+        "maxPoolSize": DB_MAX_POOL_SIZE,
+        "minPoolSize": DB_MIN_POOL_SIZE,
+    }
+    if DB_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = DB_MAX_IDLE_TIME_MS
+    if DB_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = DB_WAIT_QUEUE_TIMEOUT_MS
+    if DB_COMPRESSORS:
+        options["compressors"] = DB_COMPRESSORS
+    return options
+
+
+# ---------- Async client, one per process ----------
+_async_client: Optional[AsyncMongoClient] = None
+_client_pid: Optional[int] = None
+
+
+def create_async_mongo_client(
     uri: str,
     server_api_version: str = "1",
-    max_retries: int = 3,
-    retry_delay: float = 1.0,
     server_selection_timeout_ms: int = 5000,
     connect_timeout_ms: int = 10000,
-) -> MongoClient:
+) -> AsyncMongoClient:
     """
-    Create and return a connected MongoClient with basic retry/backoff.
-    Exits the process if connection cannot be established.
+    Return this process's AsyncMongoClient, creating it on first use.
+    The client connects lazily, so this never blocks the event loop.
+    A client inherited from a parent process is dropped, never reused.
     """
-    global _client
-    if _client:
-        return _client
+    global _async_client, _client_pid
+    if _async_client and _client_pid == os.getpid():
+        return _async_client
+
+    _async_client = AsyncMongoClient(
+        uri,
+        server_api=ServerApi(server_api_version),
+        serverSelectionTimeoutMS=server_selection_timeout_ms,
+        connectTimeoutMS=connect_timeout_ms,
+        event_listeners=[command_metrics, pool_metrics],
+        **pool_options(),
+    )
+    _client_pid = os.getpid()
+    return _async_client
+
 
-    attempt = 0
-    last_exc: Optional[Exception] = None
-    while attempt < max_retries:
+async def connect(max_retries: int = DB_CONNECT_RETRIES, retry_delay: float = 1.0) -> None:
+    """
+    Create the client for this worker and ping until MongoDB answers,
+    backing off between attempts. Raises the last error on failure.
+    """
+    client = create_async_mongo_client(MONGO_DB_URL)
+    for attempt in range(1, max_retries + 1):
         try:
             logger.info(
-                "Attempting to connect to MongoDB (attempt %d/%d)...",
-                attempt + 1,
-                max_retries,
+                "Attempting to connect to MongoDB (attempt %d/%d)...", attempt, max_retries
             )
-            client = MongoClient(
-                uri,
-                server_api=ServerApi(server_api_version),
-                serverSelectionTimeoutMS=server_selection_timeout_ms,
-                connectTimeoutMS=connect_timeout_ms,
-            )
-            # Force a call to verify connection
-            client.admin.command("ping")
+            await client.admin.command("ping")
             logger.info("Connected to MongoDB (database: %s)", MONGO_DB_NAME)
-            _client = client
-            return client
+            return
         except PyMongoError as exc:
-            last_exc = exc
             logger.warning("MongoDB connection failed: %s", exc)
-            attempt += 1
-            if attempt < max_retries:
-                sleep = retry_delay * (2 ** (attempt - 1))
-                logger.info("Retrying in %.1f seconds...", sleep)
-                time.sleep(sleep)
-
-    logger.critical(
-        "Could not connect to MongoDB after %d attempts. Exiting.", max_retries
-    )
-    if last_exc:
-        logger.exception(last_exc)
-    sys.exit(1)
+            if attempt == max_retries:
+                logger.critical("Could not connect to MongoDB after %d attempts.", max_retries)
+                raise
+            sleep = retry_delay * (2 ** (attempt - 1))
+            logger.info("Retrying in %.1f seconds...", sleep)
+            await asyncio.sleep(sleep)
 
 
-# Create client (module import will try to connect)
-client = create_mongo_client(MONGO_DB_URL)
-
+async def ping(timeout: float = 2.0) -> Optional[str]:
+    """
+    Return None if MongoDB answers within `timeout` seconds, else the error.
+    """
+    try:
+        await asyncio.wait_for(get_async_db().command("ping"), timeout)
+    except (PyMongoError, asyncio.TimeoutError) as exc:
+        return str(exc) or type(exc).__name__
+    return None
 
-# Ensure client is closed on process exit
-def _close_client() -> None:
-    global _client
-    if _client:
-        try:
-            _client.close()
-            logger.info("MongoDB client closed.")
-        except Exception as exc:
-            logger.debug("Error closing MongoDB client: %s", exc)
 
+async def close_async_client() -> None:
+    global _async_client, _client_pid
+    if _async_client and _client_pid == os.getpid():
+        await _async_client.close()
+        logger.info("Async MongoDB client closed.")
+    _async_client = None
+    _client_pid = None
 
-atexit.register(_close_client)
 
 # ---------- Database & collections ----------
-db = client[MONGO_DB_NAME]
+def get_async_db():
+    return create_async_mongo_client(MONGO_DB_URL)[MONGO_DB_NAME]
 
 
-# ---------- Optional utility accessors ----------
-def get_db():
-    return db
-
-
-def get_collection(name: CollectionName):
-    return db[name]
+def get_async_collection(name: CollectionName, read_only: bool = False):
+    """
+    Return a collection handle. Read-only routes pass read_only=True to
+    read with DB_READ_PREFERENCE, which may serve slightly stale data.
+    """
+    collection = get_async_db()[name]
+    if read_only and DB_READ_PREFERENCE != "primary":
+        return collection.with_options(read_preference=_READ_PREFERENCES[DB_READ_PREFERENCE])
+    return collection
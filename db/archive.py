@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import os
+import socket
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from db import close_async_client, get_async_collection
+from db.changes import add_tombstones, next_seq, seq_write
+from db.content import decode_notes
+from search.indexing import note_indexes
+from util import _get_env, logger
+
+ARCHIVE_ENABLED = _get_env("ARCHIVE_ENABLED", required=False, default="true")
+# Users deactivated for less than this keep their notes in place
+ARCHIVE_AFTER_DAYS = float(_get_env("ARCHIVE_AFTER_DAYS", required=False, default="30"))
+ARCHIVE_INTERVAL_SECONDS = float(
+    _get_env("ARCHIVE_INTERVAL_SECONDS", required=False, default="3600")
+)
+ARCHIVE_BATCH_SIZE = int(_get_env("ARCHIVE_BATCH_SIZE", required=False, default="500"))
+# Pause between batches, so archiving never saturates the primary
+ARCHIVE_BATCH_PAUSE_MS = int(
+    _get_env("ARCHIVE_BATCH_PAUSE_MS", required=False, default="200")
+)
+# How often the lease holder looks for reactivated users to restore
+ARCHIVE_RESTORE_POLL_SECONDS = float(
+    _get_env("ARCHIVE_RESTORE_POLL_SECONDS", required=False, default="10")
+)
+
+_LEASE_ID = "note_archiver"
+# Renewed on every poll and every batch, so it only has to outlast one batch
+_LEASE_SECONDS = 300
+# Owner of the lease the current task works under, None outside the job
+_lease_owner: ContextVar[Optional[str]] = ContextVar("lease_owner", default=None)
+
+# users.archive_state while notes move; unset once a user is fully restored
+ARCHIVING, ARCHIVED, RESTORING = "archiving", "archived", "restoring"
+
+
+def _user_filter(user_id: str) -> dict:
+    return {"_id": ObjectId(user_id)}
+
+
+class LeaseLost(Exception):
+    """
+    Another worker took the job lease while this one was still working.
+    """
+
+
+async def _renew_lease(owner: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await get_async_collection("job_leases").update_one(
+            {"_id": _LEASE_ID, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=_LEASE_SECONDS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Another worker holds an unexpired lease
+        return False
+    return True
+
+
+async def _pause() -> None:
+    """
+    Sleep between batches, and keep the lease of the job running them.
+    """
+    if ARCHIVE_BATCH_PAUSE_MS:
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE_MS / 1000)
+    owner = _lease_owner.get()
+    if owner is not None and not await _renew_lease(owner):
+        raise LeaseLost(f"Lease {_LEASE_ID} was taken over")
+
+
+# ---------- Archive ----------
+async def _archive_notes(user_id: str) -> Optional[int]:
+    """
+    Move the user's notes to notes_archive a batch at a time. Each batch is
+    copied before it is deleted, so an interrupted run just copies some
+    notes again. Returns None when the user was reactivated meanwhile.
+    """
+    users = get_async_collection("users")
+    notes = get_async_collection("notes")
+    archive = get_async_collection("notes_archive")
+    moved = 0
+    while True:
+        batch = await notes.find({"user_id": user_id}).limit(ARCHIVE_BATCH_SIZE).to_list()
+        if not batch:
+            return moved
+        await archive.bulk_write(
+            [ReplaceOne({"_id": note["_id"]}, note, upsert=True) for note in batch],
+            ordered=False,
+        )
+        if not await users.find_one({**_user_filter(user_id), "is_active": False}, {"_id": 1}):
+            # Reactivated between the copy and the delete: keep the originals
+            await archive.delete_many({"_id": {"$in": [note["_id"] for note in batch]}})
+            return None
+        # A note changed after it was copied stays, and is copied again
+        result = await notes.bulk_write(
+            [DeleteOne({"_id": note["_id"], "seq": note.get("seq")}) for note in batch],
+            ordered=False,
+        )
+        deleted = {note["_id"] for note in batch}
+        if result.deleted_count < len(batch):
+            deleted = deleted - {
+                doc["_id"]
+                async for doc in notes.find({"_id": {"$in": list(deleted)}}, {"_id": 1})
+            }
+
+        # Shared members lose the notes, tell their clients through /changes
+        archived = [note for note in batch if note["_id"] in deleted]
+        if archived:
+            last_seq, seq_at = await next_seq(len(archived))
+            first_seq = last_seq - len(archived) + 1
+            await add_tombstones(
+                (
+                    (str(note["_id"]), member, first_seq + i)
+                    for i, note in enumerate(archived)
+                    for member in note.get("shared", [])
+                ),
+                seq_at,
+            )
+        for note in archived:
+            note_indexes.remove_note(str(note["_id"]))
+        moved += len(archived)
+        await _pause()
+
+
+async def _archive_memberships(user_id: str) -> int:
+    """
+    Take the user out of the shared arrays of other users' notes, keeping
+    each membership in archived_shares so a reactivation can put it back.
+    """
+    notes = get_async_collection("notes")
+    shares = get_async_collection("archived_shares")
+    removed = 0
+    while True:
+        batch = [
+            doc["_id"]
+            async for doc in notes.find({"shared": user_id}, {"_id": 1}).limit(ARCHIVE_BATCH_SIZE)
+        ]
+        if not batch:
+            return removed
+        await shares.bulk_write(
+            [
+                UpdateOne(
+                    {"user_id": user_id, "note_id": note_id},
+                    {"$setOnInsert": {"archived_at": datetime.now(timezone.utc)}},
+                    upsert=True,
+                )
+                for note_id in batch
+            ],
+            ordered=False,
+        )
+        updated_at = datetime.now(timezone.utc)
+        last_seq, seq_at = await next_seq(len(batch))
+        first_seq = last_seq - len(batch) + 1
+        with seq_write(seq_at):
+            await notes.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": note_id},
+                        {
+                            "$pull": {"shared": user_id},
+                            "$set": {"updated_at": updated_at, "seq": first_seq + i, "seq_at": seq_at},
+                        },
+                    )
+                    for i, note_id in enumerate(batch)
+                ],
+                ordered=False,
+            )
+        await note_indexes.refresh(str(note_id) for note_id in batch)
+        removed += len(batch)
+        await _pause()
+
+
+async def archive_user(user_id: str) -> bool:
+    """
+    Archive a deactivated user's notes and shared memberships. Safe to
+    rerun after an interruption. Returns False if the user is active.
+    """
+    users = get_async_collection("users")
+    result = await users.update_one(
+        {**_user_filter(user_id), "is_active": False}, {"$set": {"archive_state": ARCHIVING}}
+    )
+    if not result.matched_count:
+        return False
+    moved = await _archive_notes(user_id)
+    if moved is None:
+        return False
+    removed = await _archive_memberships(user_id)
+    result = await users.update_one(
+        {**_user_filter(user_id), "is_active": False, "archive_state": ARCHIVING},
+        {"$set": {"archive_state": ARCHIVED, "archived_at": datetime.now(timezone.utc)}},
+    )
+    logger.info(
+        "Archived user %s: %d notes, %d shared memberships", user_id, moved, removed
+    )
+    return bool(result.matched_count)
+
+
+# ---------- Restore ----------
+async def _park_archived_members(batch: list[dict]) -> None:
+    """
+    Members archived while these notes were in the archive were never taken
+    out of them; do that now, before the notes are visible again.
+    """
+    members = {ObjectId(u) for note in batch for u in note.get("shared", []) if ObjectId.is_valid(u)}
+    if not members:
+        return
+    users = get_async_collection("users")
+    archived = {
+        str(user["_id"])
+        async for user in users.find(
+            {"_id": {"$in": list(members)}, "archive_state": ARCHIVED}, {"_id": 1}
+        )
+    }
+    if not archived:
+        return
+    parked = []
+    for note in batch:
+        for member in archived.intersection(note.get("shared", [])):
+            parked.append(
+                UpdateOne(
+                    {"user_id": member, "note_id": note["_id"]},
+                    {"$setOnInsert": {"archived_at": datetime.now(timezone.utc)}},
+                    upsert=True,
+                )
+            )
+        note["shared"] = [u for u in note.get("shared", []) if u not in archived]
+    if parked:
+        await get_async_collection("archived_shares").bulk_write(parked, ordered=False)
+
+
+async def restore_user(user_id: str) -> dict:
+    """
+    Bring back everything archive_user moved away, for a user who has
+    been reactivated. Notes get new change sequence numbers so every
+    client sees them again through /changes.
+    """
+    users = get_async_collection("users")
+    notes = get_async_collection("notes")
+    archive = get_async_collection("notes_archive")
+    shares = get_async_collection("archived_shares")
+    await users.update_one(
+        {**_user_filter(user_id), "archive_state": {"$exists": True}},
+        {"$set": {"archive_state": RESTORING}},
+    )
+
+    restored = 0
+    while True:
+        batch = await archive.find({"user_id": user_id}).limit(ARCHIVE_BATCH_SIZE).to_list()
+        if not batch:
+            break
+        await _park_archived_members(batch)
+        # Restored notes keep their old timestamps; seq_at is what lets
+        # /changes treat them as settled only once their write has landed
+        last_seq, seq_at = await next_seq(len(batch))
+        for seq, note in enumerate(batch, start=last_seq - len(batch) + 1):
+            note["seq"], note["seq_at"] = seq, seq_at
+        with seq_write(seq_at):
+            await notes.bulk_write(
+                [ReplaceOne({"_id": note["_id"]}, note, upsert=True) for note in batch],
+                ordered=False,
+            )
+        await archive.delete_many({"_id": {"$in": [note["_id"] for note in batch]}})
+        for note in await decode_notes(batch):
+            note_indexes.index_note(note)
+        restored += len(batch)
+        await _pause()
+
+    memberships = 0
+    while True:
+        batch = await shares.find({"user_id": user_id}).limit(ARCHIVE_BATCH_SIZE).to_list()
+        if not batch:
+            break
+        updated_at = datetime.now(timezone.utc)
+        last_seq, seq_at = await next_seq(len(batch))
+        first_seq = last_seq - len(batch) + 1
+        with seq_write(seq_at):
+            await notes.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": share["note_id"]},
+                        {
+                            "$addToSet": {"shared": user_id},
+                            "$set": {"updated_at": updated_at, "seq": first_seq + i, "seq_at": seq_at},
+                        },
+                    )
+                    for i, share in enumerate(batch)
+                ],
+                ordered=False,
+            )
+        # The owner may have been archived since; their notes keep the member
+        await archive.bulk_write(
+            [
+                UpdateOne({"_id": share["note_id"]}, {"$addToSet": {"shared": user_id}})
+                for share in batch
+            ],
+            ordered=False,
+        )
+        await shares.delete_many({"_id": {"$in": [share["_id"] for share in batch]}})
+        await note_indexes.refresh((str(share["note_id"]) for share in batch), users=[user_id])
+        memberships += len(batch)
+        await _pause()
+
+    await users.update_one(
+        {**_user_filter(user_id), "archive_state": RESTORING},
+        {"$unset": {"archive_state": "", "archived_at": ""}},
+    )
+    if restored or memberships:
+        logger.info(
+            "Restored user %s: %d notes, %d shared memberships", user_id, restored, memberships
+        )
+    return {"notes": restored, "memberships": memberships}
+
+
+async def reactivate_user(user_id: str) -> bool:
+    """
+    Mark a deactivated user active again. Their archived data is left for
+    the background job to restore; returns True if there is any.
+    """
+    user = await get_async_collection("users").find_one_and_update(
+        _user_filter(user_id),
+        # Sessions ended with the deactivation, so the user can log in again
+        {"$set": {"is_active": True, "is_logged_in": False}, "$unset": {"deactivated_at": ""}},
+        {"archive_state": 1},
+    )
+    return bool(user and "archive_state" in user)
+
+
+# ---------- Background job ----------
+async def restore_pending() -> int:
+    """
+    Restore every reactivated user whose data is still archived, including
+    restores that were cut short. Returns the number of users restored.
+    """
+    users = get_async_collection("users")
+    pending = users.find({"is_active": True, "archive_state": {"$exists": True}}, {"_id": 1})
+    restored = 0
+    for user_id in [str(user["_id"]) async for user in pending]:
+        await restore_user(user_id)
+        restored += 1
+    return restored
+
+
+async def archive_due() -> int:
+    """
+    Archive every user due for it. Returns the number of users archived.
+    """
+    users = get_async_collection("users")
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    due = users.find(
+        {
+            "is_active": False,
+            "archive_state": {"$ne": ARCHIVED},
+            # Users deactivated before deactivated_at was recorded are due
+            "$or": [{"deactivated_at": {"$lte": cutoff}}, {"deactivated_at": {"$exists": False}}],
+        },
+        {"_id": 1},
+    )
+    archived = 0
+    for user_id in [str(user["_id"]) async for user in due]:
+        # A long pass must not hold back users who came back meanwhile
+        await restore_pending()
+        if await archive_user(user_id):
+            archived += 1
+    return archived
+
+
+async def run_once() -> int:
+    """
+    Finish pending restores, then archive every user due for it. Returns
+    the number of users archived.
+    """
+    await restore_pending()
+    return await archive_due()
+
+
+class NoteArchiver:
+    """
+    Runs in one worker at a time: each worker tries to take a lease in
+    job_leases, and only the holder works. The holder restores reactivated
+    users every ARCHIVE_RESTORE_POLL_SECONDS and archives due users every
+    ARCHIVE_INTERVAL_SECONDS, renewing the lease between batches.
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if ARCHIVE_ENABLED.lower() == "true":
+            self._task = asyncio.create_task(self._run(), name="note-archiver")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        # Batches run by this task renew the lease in _pause()
+        _lease_owner.set(self.owner)
+        next_archive = time.monotonic()
+        while True:
+            try:
+                if await _renew_lease(self.owner):
+                    restored = await restore_pending()
+                    if restored:
+                        logger.info("Restored %d reactivated users", restored)
+                    if time.monotonic() >= next_archive:
+                        next_archive = time.monotonic() + ARCHIVE_INTERVAL_SECONDS
+                        archived = await archive_due()
+                        if archived:
+                            logger.info("Archived %d deactivated users", archived)
+            except LeaseLost as exc:
+                logger.warning("Note archiving stopped: %s", exc)
+            except PyMongoError as exc:
+                logger.warning("Note archiving failed, retrying later: %s", exc)
+            await asyncio.sleep(ARCHIVE_RESTORE_POLL_SECONDS)
+
+
+note_archiver = NoteArchiver()
+
+
+async def _main(restore: Optional[str]) -> None:
+    try:
+        if restore:
+            await reactivate_user(restore)
+            logger.info("Restored %s", await restore_user(restore))
+        else:
+            logger.info("Archived %d deactivated users", await run_once())
+    finally:
+        await close_async_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Archive the notes of deactivated users, or restore one user's."
+    )
+    parser.add_argument(
+        "--restore", metavar="USER_ID", help="reactivate this user and restore their notes"
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.restore))
+    except PyMongoError as exc:
+        logger.critical("%s", exc)
+        raise SystemExit(1)
@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+import pymongo
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from db import close_async_client, get_async_collection
+from util import _get_env, logger
+
+# Tombstones older than this are removed by a TTL index, and sync cursors
+# older than this are refused so the client resyncs from scratch
+NOTES_TOMBSTONE_TTL_DAYS = int(
+    _get_env("NOTES_TOMBSTONE_TTL_DAYS", required=False, default="30")
+)
+TOMBSTONE_TTL_SECONDS = NOTES_TOMBSTONE_TTL_DAYS * 24 * 3600
+# Changes younger than this are held back from /changes, since a write with
+# an earlier sequence number may still be in flight in another worker
+NOTES_SYNC_SETTLE_MS = int(
+    _get_env("NOTES_SYNC_SETTLE_MS", required=False, default="5000")
+)
+# A write must land within half the settle window of reserving its number;
+# the other half is slack for clock skew between workers
+_WRITE_BUDGET = timedelta(milliseconds=NOTES_SYNC_SETTLE_MS) / 2
+
+_COUNTER_ID = "note_changes"
+
+
+async def next_seq(count: int = 1) -> tuple[int, datetime]:
+    """
+    Reserve `count` change sequence numbers and return the last one, with
+    the time they were reserved. Every note write stamps the note with its
+    own number, so the numbers order all changes across every worker, and
+    with that time as seq_at, which /changes waits on to settle. Reserve
+    right before the write so nothing slow runs in between.
+    """
+    counter = await get_async_collection("counters").find_one_and_update(
+        {"_id": _COUNTER_ID},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"], datetime.now(timezone.utc)
+
+
+class SeqWriteTimeout(PyMongoError):
+    """
+    A write did not land within the settle window of its sequence number,
+    so /changes could already have moved past it. It was aborted instead.
+    """
+
+    @property
+    def timeout(self) -> bool:
+        return True
+
+
+@contextmanager
+def seq_write(seq_at: datetime):
+    """
+    Bound the writes in the block to what is left of the settle window of
+    numbers reserved at `seq_at`, pool wait included; the server is told
+    through maxTimeMS to abort them past it. A bulk write that runs out
+    raises its BulkWriteError, with the aborted writes in writeErrors.
+    """
+    if not NOTES_SYNC_SETTLE_MS:
+        # Nothing is held back, so there is no window to stay in
+        yield
+        return
+    remaining = (seq_at + _WRITE_BUDGET - datetime.now(timezone.utc)).total_seconds()
+    if remaining <= 0:
+        raise SeqWriteTimeout("Sequence number reserved too long ago, write not attempted.")
+    try:
+        with pymongo.timeout(remaining):
+            yield
+    except BulkWriteError:
+        raise
+    except PyMongoError as exc:
+        if exc.timeout:
+            raise SeqWriteTimeout(f"Write did not land within the sync settle window: {exc}") from exc
+        raise
+
+
+async def add_tombstones(entries: Iterable[tuple[str, str, int]], seq_at: datetime) -> None:
+    """
+    Record that a note left a user's view, because it was deleted or
+    unshared. `entries` holds (note_id, user_id, seq) triples whose seq
+    was reserved at `seq_at`.
+    """
+    now = datetime.now(timezone.utc)
+    tombstones = [
+        {"note_id": note_id, "user_id": user_id, "seq": seq, "seq_at": seq_at, "deleted_at": now}
+        for note_id, user_id, seq in entries
+    ]
+    if tombstones:
+        with seq_write(seq_at):
+            await get_async_collection("note_tombstones").insert_many(tombstones)
+
+
+# ---------- Backfill ----------
+async def backfill(batch_size: int) -> int:
+    """
+    Stamp notes written before change tracking existed with a sequence
+    number, so the first sync of every client includes them.
+    """
+    notes = get_async_collection("notes")
+    stamped = 0
+    while True:
+        cursor = notes.find({"seq": {"$exists": False}}, {"_id": 1}).limit(batch_size)
+        ids = [doc["_id"] async for doc in cursor]
+        if not ids:
+            return stamped
+        last, seq_at = await next_seq(len(ids))
+        first = last - len(ids) + 1
+        operations = [
+            UpdateOne(
+                {"_id": id, "seq": {"$exists": False}},
+                {"$set": {"seq": first + i, "seq_at": seq_at}},
+            )
+            for i, id in enumerate(ids)
+        ]
+        with seq_write(seq_at):
+            stamped += (await notes.bulk_write(operations, ordered=False)).modified_count
+        logger.info("Stamped %d notes", stamped)
+
+
+async def _main(batch_size: int) -> None:
+    try:
+        logger.info("Backfill done, %d notes stamped", await backfill(batch_size))
+    finally:
+        await close_async_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Give notes without a change sequence number one."
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.batch_size))
+    except PyMongoError as exc:
+        logger.critical("%s", exc)
+        raise SystemExit(1)
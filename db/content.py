@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import zlib
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from bson import Binary, ObjectId
+from gridfs import AsyncGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from db import close_async_client, get_async_collection, get_async_db
+from util import _get_env, logger
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for NOTES_CONTENT_CODEC=zstd
+    zstandard = None
+
+NOTES_CONTENT_CODEC = _get_env("NOTES_CONTENT_CODEC", required=False, default="zlib")
+# The MongoDB $text index only sees plain content, so content is encoded by
+# default only when the bm25 search backend, which decodes it, is in use
+_ENCODE_BY_DEFAULT = _get_env("SEARCH_BACKEND", required=False, default="mongo") == "bm25"
+# Content at least this many UTF-8 bytes is stored compressed; 0 disables
+NOTES_COMPRESS_MIN_BYTES = int(
+    _get_env(
+        "NOTES_COMPRESS_MIN_BYTES", required=False, default="4096" if _ENCODE_BY_DEFAULT else "0"
+    )
+)
+# Content at least this large moves to GridFS; 0 disables
+NOTES_OFFLOAD_MIN_BYTES = int(
+    _get_env(
+        "NOTES_OFFLOAD_MIN_BYTES", required=False, default="1048576" if _ENCODE_BY_DEFAULT else "0"
+    )
+)
+CONTENT_BUCKET = "note_content"
+# Bodies larger than this are (de)compressed off the event loop
+_THREAD_MIN_BYTES = 64 * 1024
+
+if NOTES_CONTENT_CODEC not in ("zlib", "zstd"):
+    raise ValueError(f"Unknown NOTES_CONTENT_CODEC: {NOTES_CONTENT_CODEC}")
+if NOTES_CONTENT_CODEC == "zstd" and zstandard is None:
+    raise ValueError("NOTES_CONTENT_CODEC=zstd needs the zstandard package")
+if not _ENCODE_BY_DEFAULT and (NOTES_COMPRESS_MIN_BYTES or NOTES_OFFLOAD_MIN_BYTES):
+    logger.warning(
+        "Encoded note content is not in the $text index: larger notes only "
+        "match /search on their title unless SEARCH_BACKEND=bm25"
+    )
+
+# Every note field that can hold content, depending on how it is stored:
+#   content                          plain text
+#   content + content_codec          compressed bytes
+#   content_file + content_codec     compressed GridFS file, no content field
+CONTENT_FIELDS = ("content", "content_codec", "content_file")
+
+
+# ---------- Codecs ----------
+def compress(raw: bytes, codec: str = NOTES_CONTENT_CODEC) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return zlib.compress(raw, 6)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Note content is zstd compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+async def _run(func, data: bytes, codec: str) -> bytes:
+    if len(data) >= _THREAD_MIN_BYTES:
+        return await asyncio.to_thread(func, data, codec)
+    return func(data, codec)
+
+
+def _bucket() -> AsyncGridFSBucket:
+    return AsyncGridFSBucket(get_async_db(), bucket_name=CONTENT_BUCKET)
+
+
+# ---------- Write path ----------
+async def encode_content(content: str) -> dict:
+    """
+    Return the note fields that store `content`: plain text below the
+    compression threshold, compressed bytes above it, and a compressed
+    GridFS file above the offload threshold.
+    """
+    raw = content.encode()
+    if NOTES_OFFLOAD_MIN_BYTES and len(raw) >= NOTES_OFFLOAD_MIN_BYTES:
+        file_id = await _bucket().upload_from_stream(
+            "note-content",
+            await _run(compress, raw, NOTES_CONTENT_CODEC),
+            metadata={"size": len(raw)},
+        )
+        return {"content_codec": NOTES_CONTENT_CODEC, "content_file": file_id}
+    if NOTES_COMPRESS_MIN_BYTES and len(raw) >= NOTES_COMPRESS_MIN_BYTES:
+        data = await _run(compress, raw, NOTES_CONTENT_CODEC)
+        # Incompressible text stays plain
+        if len(data) < len(raw):
+            return {"content": Binary(data), "content_codec": NOTES_CONTENT_CODEC}
+    return {"content": content}
+
+
+def content_update(fields: dict, update: Optional[dict] = None) -> dict:
+    """
+    Merge encoded content `fields` into an update document, unsetting the
+    fields of whichever storage form the note used before.
+    """
+    update = update if update is not None else {}
+    update.setdefault("$set", {}).update(fields)
+    unset = {field: "" for field in CONTENT_FIELDS if field not in fields}
+    if unset:
+        update.setdefault("$unset", {}).update(unset)
+    return update
+
+
+async def delete_content_files(file_ids: Iterable[Optional[ObjectId]]) -> None:
+    file_ids = [file_id for file_id in file_ids if file_id is not None]
+    if not file_ids:
+        return
+    bucket = _bucket()
+    for file_id in file_ids:
+        try:
+            await bucket.delete(file_id)
+        except NoFile:
+            pass
+
+
+# ---------- Read path ----------
+async def _load_files(file_ids: list[ObjectId]) -> dict[ObjectId, bytes]:
+    # One query over the chunks of every file instead of two per file
+    chunks = (
+        get_async_db()[f"{CONTENT_BUCKET}.chunks"]
+        .find({"files_id": {"$in": file_ids}}, {"_id": 0, "files_id": 1, "data": 1})
+        .sort([("files_id", 1), ("n", 1)])
+    )
+    parts = defaultdict(list)
+    async for chunk in chunks:
+        parts[chunk["files_id"]].append(chunk["data"])
+    return {file_id: b"".join(data) for file_id, data in parts.items()}
+
+
+async def decode_notes(notes: list[dict]) -> list[dict]:
+    """
+    Turn stored content back into text in place, loading the GridFS bodies
+    of every offloaded note in one query.
+    """
+    file_ids = [note["content_file"] for note in notes if note.get("content_file")]
+    files = await _load_files(file_ids) if file_ids else {}
+    for note in notes:
+        codec = note.pop("content_codec", None)
+        file_id = note.pop("content_file", None)
+        if file_id is not None:
+            data = files.get(file_id)
+            if data is None:
+                logger.warning("Content file %s of note %s is missing", file_id, note.get("_id"))
+                note["content"] = ""
+                continue
+        elif codec:
+            data = note["content"]
+        else:
+            continue
+        note["content"] = (await _run(decompress, bytes(data), codec)).decode()
+    return notes
+
+
+async def decode_note(note: dict) -> dict:
+    return (await decode_notes([note]))[0]
+
+
+def decompress_prefix(data: bytes, codec: str, max_bytes: int) -> bytes:
+    """
+    Decompress at most `max_bytes` from the start of `data`, which may be
+    cut short, such as the first GridFS chunk of a file.
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Note content is zstd compressed but zstandard is not installed")
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            return reader.read(max_bytes)
+    return zlib.decompressobj().decompress(data, max_bytes)
+
+
+async def preview_notes(notes: list[dict], length: int) -> list[dict]:
+    """
+    Like decode_notes, but only the first `length` characters of content
+    are needed. Plain text was already cut by the projection; encoded
+    content is only decompressed as far as the preview reaches, and of an
+    offloaded body only the first chunk is read.
+    """
+    file_ids = [note["content_file"] for note in notes if note.get("content_file")]
+    first_chunks = {}
+    if file_ids:
+        chunks = get_async_db()[f"{CONTENT_BUCKET}.chunks"].find(
+            {"files_id": {"$in": file_ids}, "n": 0}, {"_id": 0, "files_id": 1, "data": 1}
+        )
+        first_chunks = {chunk["files_id"]: chunk["data"] async for chunk in chunks}
+    for note in notes:
+        codec = note.pop("content_codec", None)
+        file_id = note.pop("content_file", None)
+        if file_id is not None:
+            data = first_chunks.get(file_id, b"")
+        elif codec:
+            data = note["content"]
+        else:
+            continue
+        # A character takes at most 4 bytes of UTF-8; a character cut in
+        # half at the end is dropped
+        raw = decompress_prefix(bytes(data), codec, length * 4)
+        note["content"] = raw.decode(errors="ignore")[:length]
+    return notes
+
+
+# ---------- Migration ----------
+async def migrate(batch_size: int) -> int:
+    """
+    Re-encode plain content that is over a threshold. Safe to interrupt and
+    rerun: encoded notes no longer match, and a note edited in the meantime
+    is left alone.
+    """
+    thresholds = [n for n in (NOTES_COMPRESS_MIN_BYTES, NOTES_OFFLOAD_MIN_BYTES) if n]
+    if not thresholds:
+        return 0
+    notes = get_async_collection("notes")
+    cursor = notes.find(
+        {
+            "content": {"$type": "string"},
+            "$expr": {"$gte": [{"$strLenBytes": "$content"}, min(thresholds)]},
+        },
+        {"content": 1},
+    ).batch_size(batch_size)
+
+    migrated = 0
+    operations = []
+    async for note in cursor:
+        fields = await encode_content(note["content"])
+        if fields.get("content") == note["content"]:
+            continue
+        update = content_update(fields)
+        match = {"_id": note["_id"], "content": note["content"]}
+        if "content_file" in fields:
+            # Checked one by one so a lost race does not orphan the file
+            result = await notes.update_one(match, update)
+            if result.matched_count:
+                migrated += 1
+            else:
+                await delete_content_files([fields["content_file"]])
+            continue
+        operations.append(UpdateOne(match, update))
+        if len(operations) >= batch_size:
+            migrated += (await notes.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+            logger.info("Encoded content of %d notes", migrated)
+    if operations:
+        migrated += (await notes.bulk_write(operations, ordered=False)).modified_count
+    return migrated
+
+
+async def inline(batch_size: int) -> int:
+    """
+    Undo migrate(): store every note's content as plain text again.
+    """
+    notes = get_async_collection("notes")
+    cursor = notes.find(
+        {"content_codec": {"$exists": True}}, dict.fromkeys(CONTENT_FIELDS, 1)
+    )
+    restored = 0
+    async for note in cursor.batch_size(batch_size):
+        file_id = note.get("content_file")
+        match = {"_id": note["_id"], "content_codec": note["content_codec"]}
+        if file_id is not None:
+            match["content_file"] = file_id
+        content = (await decode_note(note))["content"]
+        result = await notes.update_one(match, content_update({"content": content}))
+        if result.matched_count:
+            restored += 1
+            await delete_content_files([file_id])
+    return restored
+
+
+async def _main(restore: bool, batch_size: int) -> None:
+    try:
+        if restore:
+            logger.info("Restored plain content of %d notes", await inline(batch_size))
+        else:
+            logger.info("Encoded content of %d notes", await migrate(batch_size))
+    finally:
+        await close_async_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compress or offload existing note content per the NOTES_* thresholds."
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--inline", action="store_true", help="restore every note's content to plain text"
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.inline, args.batch_size))
+    except PyMongoError as exc:
+        logger.critical("%s", exc)
+        raise SystemExit(1)
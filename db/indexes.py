@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from db import close_async_client, get_async_collection
+from db.changes import TOMBSTONE_TTL_SECONDS
+from util import logger
+
+# ---------- Declarative index spec ----------
+INDEXES: dict[str, list[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+        # Only users being archived or restored have archive_state
+        IndexModel([("archive_state", ASCENDING)], sparse=True, name="archive_state"),
+    ],
+    "notes": [
+        # Owned notes in list order, also serves single-note ownership checks
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_id_created_at",
+        ),
+        # Multikey index for notes shared with a user, same order as above
+        IndexModel(
+            [("shared", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="shared_created_at",
+        ),
+        # Change feed for GET /notes/changes, owned and shared
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)], name="user_id_seq"),
+        IndexModel([("shared", ASCENDING), ("seq", ASCENDING)], name="shared_seq"),
+        # Every user's changes, for the bm25 search index catch-up
+        IndexModel([("seq", ASCENDING)], name="seq"),
+        IndexModel(
+            [("title", TEXT), ("content", TEXT)],
+            weights={"title": 10, "content": 1},
+            name="title_content_text",
+        ),
+    ],
+    "blacklisted_tokens": [
+        IndexModel([("jti", ASCENDING)], name="jti"),
+        # Legacy rows that stored the full token before jti existed
+        IndexModel([("token", ASCENDING)], sparse=True, name="token"),
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+        # Rows are removed by MongoDB once the token itself has expired
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "note_tombstones": [
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)], name="user_id_seq"),
+        IndexModel([("seq", ASCENDING)], name="seq"),
+        # Compaction: tombstones are dropped after NOTES_TOMBSTONE_TTL_DAYS
+        IndexModel(
+            [("deleted_at", ASCENDING)],
+            expireAfterSeconds=TOMBSTONE_TTL_SECONDS,
+            name="deleted_at_ttl",
+        ),
+    ],
+    "notes_archive": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "archived_shares": [
+        IndexModel(
+            [("user_id", ASCENDING), ("note_id", ASCENDING)], unique=True, name="user_id_note_id"
+        ),
+    ],
+    "rate_limits": [
+        # Idle buckets are full again long before this, so dropping them is free
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=3600, name="updated_at_ttl"),
+    ],
+}
+
+
+# Options that make two indexes on the same keys behave differently
+_INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "weights", "partialFilterExpression")
+# IndexOptionsConflict and IndexKeySpecsConflict
+_CONFLICT_CODES = (85, 86)
+
+
+def _key_pattern(key) -> tuple:
+    """
+    Key pattern as MongoDB stores it, so a declared index can be matched
+    against index_information() whatever its name. Every text index is
+    stored under the same _fts/_ftsx keys.
+    """
+    items = list(key.items()) if isinstance(key, dict) else list(key)
+    if any(direction == TEXT for _, direction in items):
+        return (("_fts", TEXT), ("_ftsx", 1))
+    return tuple(
+        (field, int(direction) if isinstance(direction, (int, float)) else direction)
+        for field, direction in items
+    )
+
+
+def _options(index: dict) -> dict:
+    return {option: index[option] for option in _INDEX_OPTIONS if option in index}
+
+
+async def ensure_indexes() -> list[str]:
+    """
+    Create every index in INDEXES whose key pattern does not exist yet.
+    An existing index on the same keys counts whatever it is called; if
+    its options differ from the spec, or creating an index conflicts with
+    one that exists, a warning is logged and startup goes on.
+    Returns the names of the indexes that were created.
+    """
+    created = []
+    for name, models in INDEXES.items():
+        collection = get_async_collection(name)
+        existing = {
+            _key_pattern(info["key"]): (index_name, info)
+            for index_name, info in (await collection.index_information()).items()
+        }
+        for model in models:
+            spec = model.document
+            match = existing.get(_key_pattern(spec["key"]))
+            if match is not None:
+                index_name, info = match
+                if _options(info) != _options(spec):
+                    logger.warning(
+                        "Index %s on %s has options %s, expected %s for %s; leaving it as is",
+                        index_name, name, _options(info), _options(spec), spec["name"],
+                    )
+                continue
+            try:
+                created += await collection.create_indexes([model])
+            except OperationFailure as exc:
+                if exc.code not in _CONFLICT_CODES:
+                    raise
+                logger.warning("Index %s on %s not created: %s", spec["name"], name, exc)
+                continue
+            logger.info("Created index %s on %s", spec["name"], name)
+    return created
+
+
+# ---------- Hot query verification ----------
+def _hot_queries():
+    user_id = str(ObjectId())
+    now = datetime.now(timezone.utc)
+    notes = get_async_collection("notes")
+    users = get_async_collection("users")
+    blacklisted = get_async_collection("blacklisted_tokens")
+    tombstones = get_async_collection("note_tombstones")
+    return {
+        "users.by_email": users.find({"email": "probe@example.com"}),
+        "users.by_key": users.find({"key": "probe"}),
+        "users.restores": users.find({"is_active": True, "archive_state": {"$exists": True}}),
+        "notes.list": notes.find(
+            {"$or": [{"user_id": user_id}, {"shared": user_id}]}
+        ).sort([("created_at", -1), ("_id", -1)]),
+        "notes.owned": notes.find({"user_id": user_id}).sort([("created_at", -1), ("_id", -1)]),
+        "notes.shared": notes.find({"shared": user_id}),
+        "notes.export": notes.find({"user_id": user_id}).sort([("created_at", 1), ("_id", 1)]),
+        "notes.changes": notes.find(
+            {"$or": [{"user_id": user_id}, {"shared": user_id}], "seq": {"$gt": 0}}
+        ).sort([("seq", 1)]),
+        "note_tombstones.changes": tombstones.find(
+            {"user_id": user_id, "seq": {"$gt": 0}}
+        ).sort([("seq", 1)]),
+        "notes.search_sync": notes.find({"seq": {"$gt": 0}}),
+        "note_tombstones.search_sync": tombstones.find({"seq": {"$gt": 0}}),
+        "notes.search": notes.find(
+            {"user_id": user_id, "$text": {"$search": "probe"}},
+            {"score": {"$meta": "textScore"}},
+        ),
+        "blacklisted_tokens.by_jti": blacklisted.find({"jti": "probe"}),
+        "blacklisted_tokens.sync": blacklisted.find(
+            {"jti": {"$exists": True}, "expires_at": {"$gt": now}, "revoked_at": {"$gte": now}}
+        ),
+    }
+
+
+def _stages(plan) -> set[str]:
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= _stages(value)
+    return stages
+
+
+async def check_indexes() -> dict[str, set[str]]:
+    """
+    Run explain() on each hot query and raise if any of them falls back to
+    a collection scan. Returns the plan stages used by every query.
+    """
+    plans = {}
+    offenders = []
+    for name, cursor in _hot_queries().items():
+        explain = await cursor.explain()
+        stages = _stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        plans[name] = stages
+        if "COLLSCAN" in stages:
+            offenders.append(name)
+    if offenders:
+        raise RuntimeError(f"Hot queries fall back to COLLSCAN: {', '.join(offenders)}")
+    return plans
+
+
+async def _main(check: bool) -> None:
+    try:
+        created = await ensure_indexes()
+        logger.info("Index bootstrap done, %d created", len(created))
+        if check:
+            for name, stages in (await check_indexes()).items():
+                logger.info("%s: %s", name, ", ".join(sorted(stages)))
+    finally:
+        await close_async_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and verify MongoDB indexes.")
+    parser.add_argument(
+        "--check", action="store_true", help="explain hot queries and fail on COLLSCAN"
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.check))
+    except (RuntimeError, PyMongoError) as exc:
+        logger.critical("%s", exc)
+        raise SystemExit(1)
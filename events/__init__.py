@@ -0,0 +1,64 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+from fastapi.params import Depends
+from fastapi.responses import StreamingResponse
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
+
+from events.hub import note_events
+from util import _get_env
+from util.response import dumps
+from util.security import verify_access
+
+router = APIRouter()
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="events")
+api_key_scheme = APIKeyHeader(name="X-API-Key")
+
+# Idle connections get a comment line this often, which also re-checks auth
+EVENTS_HEARTBEAT_SECONDS = float(
+    _get_env("EVENTS_HEARTBEAT_SECONDS", required=False, default="15")
+)
+
+
+# Endpoint to stream note changes as Server-Sent Events
+@router.get("")
+async def stream_events(
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
+):
+    user_id = await verify_access(token, key)
+    if note_events.full():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many event connections.",
+            headers={"Retry-After": "5"},
+        )
+    return StreamingResponse(
+        _events(user_id, token, key),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _events(user_id: str, token: str, key: str):
+    # Subscribed only once the response starts, so the finally below always runs
+    subscriber = note_events.subscribe(user_id)
+    try:
+        yield b"retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.get(), EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Ends the stream once the token expires or is revoked
+                try:
+                    await verify_access(token, key)
+                except HTTPException:
+                    return
+                yield b": ping\n\n"
+                continue
+            if event["type"] == "resync":
+                yield b"event: resync\ndata: {}\n\n"
+                continue
+            yield b"id: %d\nevent: note\ndata: %s\n\n" % (event["seq"], dumps(event))
+    finally:
+        note_events.unsubscribe(subscriber)
@@ -0,0 +1,177 @@
+import asyncio
+from typing import Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from db import get_async_db
+from util import _get_env, logger
+
+# Events buffered per connection before it is treated as a slow consumer
+EVENTS_QUEUE_SIZE = int(_get_env("EVENTS_QUEUE_SIZE", required=False, default="100"))
+EVENTS_MAX_CONNECTIONS = int(
+    _get_env("EVENTS_MAX_CONNECTIONS", required=False, default="10000")
+)
+EVENTS_RETRY_MAX_SECONDS = 30.0
+
+# Only the fields needed to route an event, never the note body
+_PIPELINE = [
+    {
+        "$match": {
+            "ns.coll": {"$in": ["notes", "note_tombstones"]},
+            "operationType": {"$in": ["insert", "update", "replace"]},
+        }
+    },
+    {
+        "$project": {
+            "ns": 1,
+            "documentKey": 1,
+            "fullDocument.user_id": 1,
+            "fullDocument.shared": 1,
+            "fullDocument.seq": 1,
+            "fullDocument.note_id": 1,
+        }
+    },
+]
+
+# Sent in place of the dropped events when a consumer falls behind
+RESYNC = {"type": "resync"}
+
+
+class Subscriber:
+    __slots__ = ("user_id", "queue", "dropped")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.dropped = False
+
+    def push(self, event: dict) -> bool:
+        """
+        Queue an event without ever blocking the fan-out. When the queue is
+        full its events are replaced by a single resync marker, telling the
+        client to catch up through GET /notes/changes.
+        """
+        if self.dropped:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.dropped = True
+            return False
+
+    async def get(self) -> dict:
+        event = await self.queue.get()
+        if event is RESYNC:
+            self.dropped = False
+        return event
+
+
+class NoteEventHub:
+    """
+    Fans note changes out to the connections of every affected user. Each
+    worker reads one MongoDB change stream over notes and tombstones, no
+    matter how many clients are connected.
+    """
+
+    def __init__(self):
+        self.subscribers: dict[str, set[Subscriber]] = {}
+        self.connections = 0
+        self.events = 0
+        self.dropped_events = 0
+        self._resume_token = None
+        self._task: Optional[asyncio.Task] = None
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "events": self.events,
+            "dropped_events": self.dropped_events,
+        }
+
+    def full(self) -> bool:
+        return self.connections >= EVENTS_MAX_CONNECTIONS
+
+    def subscribe(self, user_id: str) -> Subscriber:
+        subscriber = Subscriber(user_id)
+        self.subscribers.setdefault(user_id, set()).add(subscriber)
+        self.connections += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self.subscribers.get(subscriber.user_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.subscribers[subscriber.user_id]
+        self.connections -= 1
+
+    def publish(self, user_ids, event: dict) -> None:
+        for user_id in user_ids:
+            for subscriber in self.subscribers.get(user_id, ()):
+                if not subscriber.push(event):
+                    self.dropped_events += 1
+        self.events += 1
+
+    def resync_all(self) -> None:
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                subscriber.push(RESYNC)
+
+    def dispatch(self, change: dict) -> None:
+        doc = change.get("fullDocument")
+        if not doc:
+            # Updated and deleted again before the lookup, a tombstone follows
+            return
+        if change["ns"]["coll"] == "note_tombstones":
+            event = {"type": "delete", "id": doc["note_id"], "seq": doc["seq"]}
+            self.publish([doc["user_id"]], event)
+            return
+        if "seq" not in doc:
+            return
+        event = {"type": "upsert", "id": str(change["documentKey"]["_id"]), "seq": doc["seq"]}
+        self.publish(dict.fromkeys([doc["user_id"], *doc.get("shared", [])]), event)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="note-events")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                async with await get_async_db().watch(
+                    _PIPELINE,
+                    full_document="updateLookup",
+                    resume_after=self._resume_token,
+                ) as stream:
+                    delay = 1.0
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        self.dispatch(change)
+            except PyMongoError as exc:
+                if isinstance(exc, OperationFailure) and self._resume_token is not None:
+                    # The resume point fell off the oplog, so events were lost
+                    logger.warning("Note change stream cannot resume, starting over: %s", exc)
+                    self._resume_token = None
+                    self.resync_all()
+                    continue
+                # Standalone servers have no change streams; keep retrying slowly
+                logger.warning("Note change stream failed, retrying in %.0fs: %s", delay, exc)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, EVENTS_RETRY_MAX_SECONDS)
+
+
+note_events = NoteEventHub()
@@ -1,23 +1,117 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from auth import router as auth_endpoints
 from users import router as users_endpoints
 from notes import router as notes_endpoints
 from search import router as search_endpoints
+from events import router as events_endpoints
+from events.hub import note_events
+from db.archive import note_archiver
+from search.backend import search_backend
+from search.suggest import suggest_index
+from db import DB_MAX_POOL_SIZE, close_async_client, connect, ping
+from db.changes import SeqWriteTimeout
+from db.indexes import check_indexes, ensure_indexes
+from util import _get_env
+from util.revocation import revocations
+from util import metrics, ratelimit
+from util.security import auth_cache, hash_pending, shutdown_hash_pool
 
-app = FastAPI()
+
+DB_ENSURE_INDEXES = _get_env("DB_ENSURE_INDEXES", required=False, default="true")
+DB_CHECK_INDEXES = _get_env("DB_CHECK_INDEXES", required=False, default="false")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each worker after fork, so every worker gets its own client
+    await connect()
+    if DB_ENSURE_INDEXES.lower() == "true":
+        await ensure_indexes()
+    if DB_CHECK_INDEXES.lower() == "true":
+        # Refuse to start if a hot query would scan a whole collection
+        await check_indexes()
+    # Load revoked tokens and keep them in sync with other workers
+    await revocations.start()
+    await search_backend.start()
+    # One change stream per worker feeds every /events connection
+    await note_events.start()
+    # Archives deactivated users' notes, in whichever worker holds the lease
+    await note_archiver.start()
+    yield
+    await note_archiver.stop()
+    await note_events.stop()
+    await search_backend.stop()
+    await revocations.stop()
+    await close_async_client()
+    shutdown_hash_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.register_gauges("auth_cache", "Authentication context cache counters.", auth_cache.stats)
+metrics.register_gauges("suggest_cache", "Title suggest index cache counters.", suggest_index.cache.stats)
+metrics.register_gauges("note_events", "Server-sent event connections and fan-out.", note_events.stats)
+metrics.register_gauges("mongo_pool", "MongoDB connection pool state.", metrics.pool_metrics.stats)
+metrics.register_gauges(
+    "app_queue",
+    "In-process queues and sets.",
+    lambda: {"hash_pending": hash_pending(), "revoked_tokens": len(revocations)},
+)
+metrics.register_gauges("admission_in_flight", "Requests in flight per route class.", ratelimit.in_flight)
 
 # Include authentication endpoints
 app.include_router(auth_endpoints)
+metrics.register_routes(auth_endpoints.routes, "")
 
 # Include users endpoints
 app.include_router(users_endpoints, prefix="/users")
+metrics.register_routes(users_endpoints.routes, "/users")
 
 # Include notes endpoints
 app.include_router(notes_endpoints, prefix="/notes")
+metrics.register_routes(notes_endpoints.routes, "/notes")
 
 # Include search endpoints
 app.include_router(search_endpoints, prefix="/search")
+metrics.register_routes(search_endpoints.routes, "/search")
+
+# Include server-sent event endpoints
+app.include_router(events_endpoints, prefix="/events")
+metrics.register_routes(events_endpoints.routes, "/events")
+
+
+# A note write that could not land in time was aborted, so it is safe to retry
+@app.exception_handler(SeqWriteTimeout)
+async def seq_write_timeout(request: Request, exc: SeqWriteTimeout):
+    return JSONResponse(
+        {"detail": "Database is too slow, try again."},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
+
 
 @app.get("/")
 def read_root():
-    return {"Hello": "World"}
\ No newline at end of file
+    return {"Hello": "World"}
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Readiness probe; the ping also times out while the connection pool is exhausted
+@app.get("/ready", include_in_schema=False)
+async def read_ready():
+    error = await ping()
+    pool = metrics.pool_metrics.stats()
+    pool["max_pool_size"] = DB_MAX_POOL_SIZE
+    ready = error is None
+    body = {"status": "ready" if ready else "unavailable", "pool": pool}
+    if error:
+        body["error"] = error
+    return JSONResponse(body, status_code=200 if ready else 503)
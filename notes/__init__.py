@@ -1,27 +1,84 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import zlib
+from typing import Literal, Optional
 from bson import ObjectId
-from fastapi import APIRouter, HTTPException
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pydantic import ValidationError
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
 from fastapi.params import Depends
 from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
-from type.notes import Note, NoteCreate, NoteUpdate
-
-from db import get_collection
+from type.notes import (
+    NOTE_FIELDS,
+    Note,
+    NoteAdapter,
+    NoteArchive,
+    NoteChangesAdapter,
+    NoteCreate,
+    NoteCreateListAdapter,
+    NoteListAdapter,
+    NoteShare,
+    NoteUpdate,
+    note_fields_list_adapter,
+)
+
+from db import get_async_collection
+from db.changes import (
+    NOTES_SYNC_SETTLE_MS,
+    TOMBSTONE_TTL_SECONDS,
+    SeqWriteTimeout,
+    add_tombstones,
+    next_seq,
+    seq_write,
+)
+from db.content import (
+    content_update,
+    decode_note,
+    decode_notes,
+    delete_content_files,
+    encode_content,
+    preview_notes,
+)
+from notes.archive import export_lines, gzip_stream, is_gzip, restore_notes
+from notes.ingest import import_notes, is_ndjson
+from search.indexing import note_indexes
+from util import _get_env
+from util.etag import VERSION_PROJECTION, check_if_match, etag_matches, list_etag, note_etag
+from util.fields import PREVIEW_MAX_CHARS, note_projection, parse_fields
+from util.pagination import (
+    decode_change_cursor,
+    encode_change_cursor,
+    encode_cursor,
+    keyset_after,
+)
+from util.ratelimit import admission
+from util.response import dumps, model_response
 from util.security import verify_access
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="notes")
 api_key_scheme = APIKeyHeader(name="X-API-Key")
 
+NOTES_PAGE_SIZE = int(_get_env("NOTES_PAGE_SIZE", required=False, default="100"))
+NOTES_MAX_PAGE_SIZE = int(
+    _get_env("NOTES_MAX_PAGE_SIZE", required=False, default="1000")
+)
+NOTES_STREAM_BATCH_SIZE = int(
+    _get_env("NOTES_STREAM_BATCH_SIZE", required=False, default="500")
+)
+
 
 # Endpoint to create a new note
 @router.post("")
-def create_note(
+async def create_note(
     note: NoteCreate,
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
+    user_id = await verify_access(token, key)
+    notes = get_async_collection("notes")
     new_note = Note(
         user_id=user_id,
         title=note.title,
@@ -30,7 +87,12 @@ def create_note(
         updated_at=None,
         shared=[],
     )
-    result = notes.insert_one(new_note.model_dump(exclude={"id"}))
+    doc = new_note.model_dump(exclude={"id", "content"})
+    doc.update(await encode_content(note.content))
+    doc["seq"], doc["seq_at"] = await next_seq()
+    with seq_write(doc["seq_at"]):
+        result = await notes.insert_one(doc)
+    note_indexes.index_note({**doc, "content": note.content})
     return {
         "id": str(result.inserted_id),
         "message": "Note created successfully",
@@ -38,14 +100,43 @@ def create_note(
 
 
 # Endpoint to create a new notes
-@router.post("/bulk")
-def create_notes(
-    note: list[NoteCreate],
+@router.post(
+    "/bulk",
+    dependencies=[Depends(admission("bulk"))],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/NoteCreate"},
+                    }
+                },
+                # One NoteCreate object per line, inserted as it streams in
+                "application/x-ndjson": {
+                    "schema": {"$ref": "#/components/schemas/NoteCreate"}
+                },
+            },
+        }
+    },
+)
+async def create_notes(
+    request: Request,
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
+    user_id = await verify_access(token, key)
+    if is_ndjson(request.headers.get("content-type")):
+        return await import_notes(user_id, request.stream())
+    try:
+        note = NoteCreateListAdapter.validate_json(await request.body())
+    except ValidationError as exc:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in exc.errors(include_url=False)]
+        )
+
+    notes = get_async_collection("notes")
     new_notes = []
     time = datetime.now(timezone.utc)
     for n in note:
@@ -57,200 +148,617 @@ def create_notes(
             updated_at=None,
             shared=[],
         )
-        new_notes.append(new_note.model_dump(exclude={"id"}))
-    result = notes.insert_many(new_notes)
+        doc = new_note.model_dump(exclude={"id", "content"})
+        doc.update(await encode_content(n.content))
+        new_notes.append(doc)
+    # Reserved once every body is encoded, right before the write
+    last_seq, seq_at = await next_seq(len(new_notes))
+    for i, doc in enumerate(new_notes, start=last_seq - len(new_notes) + 1):
+        doc["seq"], doc["seq_at"] = i, seq_at
+    with seq_write(seq_at):
+        result = await notes.insert_many(new_notes)
+    for doc, n in zip(new_notes, note):
+        note_indexes.index_note({**doc, "content": n.content})
     return {
         "ids": [str(id) for id in result.inserted_ids],
         "message": "Notes created successfully",
     }
 
 
+# Endpoint to export every owned note
+@router.get("/export", dependencies=[Depends(admission("bulk"))])
+async def export_notes(
+    format: Literal["ndjson", "gzip"] = "ndjson",
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
+):
+    user_id = await verify_access(token, key)
+    filename = f"notes-{user_id}-{datetime.now(timezone.utc):%Y%m%d}.ndjson"
+    if format == "gzip":
+        return StreamingResponse(
+            gzip_stream(export_lines(user_id)),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'},
+        )
+    return StreamingResponse(
+        export_lines(user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Endpoint to restore notes from an export
+@router.post(
+    "/restore",
+    dependencies=[Depends(admission("bulk"))],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-ndjson": {"schema": NoteArchive.model_json_schema()},
+                "application/gzip": {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    },
+)
+async def restore(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
+):
+    user_id = await verify_access(token, key)
+    gzip = is_gzip(request.headers.get("content-type"), request.headers.get("content-encoding"))
+    try:
+        return await restore_notes(user_id, request.stream(), gzip)
+    except zlib.error:
+        # Notes read before the damage are already in; a rerun skips them
+        raise HTTPException(status_code=400, detail="Archive is not valid gzip data.")
+
+
+# Endpoint to fetch the notes changed since a sync cursor
+@router.get("/changes")
+async def get_changes(
+    since: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=NOTES_MAX_PAGE_SIZE),
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
+):
+    user_id = await verify_access(token, key)
+    # Read from the primary: a lagging secondary could let the cursor skip writes
+    notes = get_async_collection("notes")
+    tombstones = get_async_collection("note_tombstones")
+    now = datetime.now(timezone.utc)
+
+    seq = 0
+    if since:
+        seq, issued_at = decode_change_cursor(since)
+        if issued_at < now - timedelta(seconds=TOMBSTONE_TTL_SECONDS):
+            # Tombstones this client needs may have been compacted away
+            raise HTTPException(
+                status_code=410, detail="Sync cursor expired, sync again without since."
+            )
+    limit = limit or NOTES_PAGE_SIZE
+    horizon = (now - timedelta(milliseconds=NOTES_SYNC_SETTLE_MS)).replace(tzinfo=None)
+
+    query = {"$or": [{"user_id": user_id}, {"shared": user_id}], "seq": {"$gt": seq}}
+    upserts = await notes.find(query).sort([("seq", 1)]).limit(limit + 1).to_list()
+    deletes = []
+    if seq:
+        # A client syncing from scratch has nothing to delete
+        deletes = await (
+            tombstones.find({"user_id": user_id, "seq": {"$gt": seq}})
+            .sort([("seq", 1)])
+            .limit(limit + 1)
+            .to_list()
+        )
+    # A change settles relative to when its number was reserved; writes
+    # from before seq_at was stored fall back to their own timestamps
+    merged = sorted(
+        [
+            ("upsert", n["seq"], n.get("seq_at") or n.get("updated_at") or n["created_at"], n)
+            for n in upserts
+        ]
+        + [("delete", t["seq"], t.get("seq_at") or t["deleted_at"], t) for t in deletes],
+        key=lambda change: change[1],
+    )
+
+    # Stop at the first change that has not settled yet, it is returned next time
+    changes = []
+    issued_at = horizon
+    has_more = False
+    for change in merged:
+        if change[2].replace(tzinfo=None) > horizon:
+            break
+        if len(changes) == limit:
+            # Resume from the last change returned, not from the horizon
+            has_more = True
+            issued_at = changes[-1][2].replace(tzinfo=None)
+            break
+        changes.append(change)
+    if changes:
+        seq = changes[-1][1]
+
+    await decode_notes([doc for kind, _, _, doc in changes if kind == "upsert"])
+    items = []
+    for kind, change_seq, _, doc in changes:
+        if kind == "delete":
+            items.append({"type": kind, "id": doc["note_id"], "seq": change_seq})
+        else:
+            doc["id"] = str(doc.pop("_id"))
+            items.append({"type": kind, "id": doc["id"], "seq": change_seq, "note": doc})
+
+    return model_response(
+        NoteChangesAdapter,
+        {
+            "changes": items,
+            "next": encode_change_cursor(seq, issued_at.replace(tzinfo=timezone.utc)),
+            "has_more": has_more,
+        },
+    )
+
+
 # Endpoint to fetch a specific note by ID
 @router.get("/{id}")
-def get_note(
-    id: str, token: str = Depends(oauth2_scheme), key: str = Depends(api_key_scheme)
+async def get_note(
+    id: str,
+    if_none_match: Optional[str] = Header(None),
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
+    user_id = await verify_access(token, key)
+    notes = get_async_collection("notes", read_only=True)
+    query = {"_id": ObjectId(id), "user_id": user_id}
 
-    note = notes.find_one({"_id": ObjectId(id), "user_id": user_id})
+    if if_none_match:
+        # Decide on 304 from the version fields alone, without the body
+        version = await notes.find_one(query, VERSION_PROJECTION)
+        if version and etag_matches(if_none_match, note_etag(version)):
+            return Response(status_code=304, headers={"ETag": note_etag(version)})
+
+    note = await notes.find_one(query)
     if not note:
         raise HTTPException(status_code=404, detail="Note not found.")
 
-    note["id"] = str(note["_id"])
-    del note["_id"]
-    return Note(**note)
+    etag = note_etag(note)
+    await decode_note(note)
+    note["id"] = str(note.pop("_id"))
+    return model_response(NoteAdapter, note, headers={"ETag": etag})
 
 
 # Endpoint to fetch all the notes
 @router.get("")
-def get_notes(
-    token: str = Depends(oauth2_scheme), key: str = Depends(api_key_scheme)
+async def get_notes(
+    limit: Optional[int] = Query(None, ge=1, le=NOTES_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False,
+    fields: Optional[str] = None,
+    preview: Optional[int] = Query(None, ge=1, le=PREVIEW_MAX_CHARS),
+    if_none_match: Optional[str] = Header(None),
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
+    user_id = await verify_access(token, key)
+    notes = get_async_collection("notes", read_only=True)
+    selected = parse_fields(fields)
+
+    # Owned and shared notes in one query, newest first
+    query = {"$or": [{"user_id": user_id}, {"shared": user_id}]}
+    if after:
+        query = {"$and": [query, keyset_after(after)]}
+    sort = [("created_at", -1), ("_id", -1)]
+    cursor = notes.find(query, note_projection(selected, preview)).sort(sort)
+
+    if stream:
+        if limit:
+            cursor = cursor.limit(limit)
+        cursor = cursor.batch_size(NOTES_STREAM_BATCH_SIZE)
+        return StreamingResponse(
+            _stream_notes(cursor, selected, preview), media_type="application/x-ndjson"
+        )
 
-    user_notes = notes.find({"user_id": user_id}).sort({"created_at": -1})
-    shared_notes = notes.find({"shared": user_id}).sort({"created_at": -1})
-    user_notes = list(user_notes) + list(shared_notes)
-    result = []
+    limit = limit or NOTES_PAGE_SIZE
+    page = f"{limit}:{after or ''}:{fields or ''}:{preview or ''}"
+    if if_none_match:
+        # The page (and whether it has a next page) is unchanged when the
+        # versions of its limit + 1 notes are, so compare those first
+        versions = (
+            await notes.find(query, VERSION_PROJECTION).sort(sort).limit(limit + 1).to_list()
+        )
+        etag = list_etag(versions, page)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    user_notes = await cursor.limit(limit + 1).to_list()
+    headers = {"ETag": list_etag(user_notes, page)}
+    if len(user_notes) > limit:
+        user_notes = user_notes[:limit]
+        last = user_notes[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["_id"])
+
+    if preview:
+        await preview_notes(user_notes, preview)
+    else:
+        await decode_notes(user_notes)
     for note in user_notes:
-        note["id"] = str(note["_id"])
-        del note["_id"]
-        result.append(Note(**note))
+        note["id"] = str(note.pop("_id"))
+    adapter = NoteListAdapter if selected is None else note_fields_list_adapter(selected)
+    return model_response(adapter, user_notes, headers=headers)
+
+
+async def _stream_notes(cursor, fields=None, preview=None):
+    # Same public fields as the JSON path, never internals such as seq
+    fields = fields or NOTE_FIELDS
+    async for note in cursor:
+        if preview:
+            await preview_notes([note], preview)
+        else:
+            await decode_note(note)
+        note = {"id": str(note.pop("_id")), **note}
+        note = {name: note[name] for name in fields if name in note}
+        yield dumps(note) + b"\n"
+
+
+# Endpoint to update notes in bulk
+@router.put("/bulk", dependencies=[Depends(admission("bulk"))])
+async def update_notes(
+    notes: list[NoteUpdate],
+    ids: list[str] = Query(...),
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
+):
+    if len(notes) != len(ids):
+        raise HTTPException(
+            status_code=400, detail="Mismatch between notes and IDs count."
+        )
+
+    user_id = await verify_access(token, key)
+    notes_collection = get_async_collection("notes")
+    users = get_async_collection("users")
+    time = datetime.now(timezone.utc)
+
+    results = [{"id": id, "status": "updated"} for id in ids]
+
+    def fail(i: int, status: str, detail: str):
+        results[i]["status"] = status
+        results[i]["detail"] = detail
+
+    # Fetch every target note the user owns in one query
+    object_ids = {}
+    for i, id in enumerate(ids):
+        if ObjectId.is_valid(id):
+            object_ids[i] = ObjectId(id)
+        else:
+            fail(i, "invalid", "Invalid note ID.")
+    owned = {
+        doc["_id"]: doc.get("content_file")
+        async for doc in notes_collection.find(
+            {"_id": {"$in": list(set(object_ids.values()))}, "user_id": user_id},
+            {"_id": 1, "content_file": 1},
+        )
+    }
+
+    # Validate every share target across all updates in one query
+    targets = {u for note in notes for u in (note.shared or []) if ObjectId.is_valid(u)}
+    known_users = {
+        str(doc["_id"])
+        async for doc in users.find(
+            {"_id": {"$in": [ObjectId(u) for u in targets]}}, {"_id": 1}
+        )
+    }
 
-    return result
+    updates = []
+    op_items = []
+    replaced_files = {}
+    for i, note in enumerate(notes):
+        if i not in object_ids:
+            continue
+        if object_ids[i] not in owned:
+            fail(i, "not_found", "Note not found.")
+            continue
+        if not (note.title or note.content or note.shared):
+            fail(i, "invalid", "No fields to update provided.")
+            continue
+        missing = [u for u in (note.shared or []) if u not in known_users]
+        if missing:
+            fail(i, "not_found", f"Users to share with not found: {', '.join(missing)}")
+            continue
+
+        update = {"$set": {"updated_at": time}}
+        if note.title is not None:
+            update["$set"]["title"] = note.title
+        if note.content is not None:
+            content_update(await encode_content(note.content), update)
+            replaced_files[i] = owned[object_ids[i]]
+        if note.shared:
+            update["$addToSet"] = {"shared": {"$each": note.shared}}
+        updates.append(update)
+        op_items.append(i)
+
+    if updates:
+        # One change sequence number per write, reserved once every body
+        # is encoded; failed writes leave harmless gaps
+        last_seq, seq_at = await next_seq(len(updates))
+        operations = []
+        for seq, i, update in zip(
+            range(last_seq - len(updates) + 1, last_seq + 1), op_items, updates
+        ):
+            update["$set"].update(seq=seq, seq_at=seq_at)
+            operations.append(UpdateOne({"_id": object_ids[i], "user_id": user_id}, update))
+        try:
+            with seq_write(seq_at):
+                await notes_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details.get("writeErrors", []):
+                fail(op_items[error["index"]], "error", error.get("errmsg", "Write failed."))
+        await note_indexes.refresh(
+            (ids[i] for i in op_items),
+            users={u for i in op_items for u in notes[i].shared or []},
+        )
+        # GridFS bodies of notes whose content was replaced
+        await delete_content_files(
+            file_id for i, file_id in replaced_files.items() if results[i]["status"] == "updated"
+        )
+
+    updated = sum(1 for r in results if r["status"] == "updated")
+    return {
+        "updated": updated,
+        "failed": len(results) - updated,
+        "results": results,
+    }
 
 
 # Endpoint to update a specific note by ID
 @router.put("/{id}")
-def update_note(
+async def update_note(
     id: str,
     note: NoteUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
-    users = get_collection("users")
+    user_id = await verify_access(token, key)
+    notes = get_async_collection("notes")
+    users = get_async_collection("users")
 
-    # Check if the note exists and belongs to the user
-    existing_note = notes.find_one({"_id": ObjectId(id), "user_id": user_id})
+    # Check if the note exists and belongs to the user, without its body
+    existing_note = await notes.find_one(
+        {"_id": ObjectId(id), "user_id": user_id}, {"content": 0}
+    )
     if not existing_note:
         raise HTTPException(status_code=404, detail="Note not found.")
+    check_if_match(if_match, existing_note)
 
     if not (note.title or note.content or note.shared):
         raise HTTPException(status_code=400, detail="No fields to update provided.")
 
     if note.shared:
-        for share_with_user_id in note.shared:
-            # Check if the user to share with exists
-            share_with_user = users.find_one({"_id": ObjectId(share_with_user_id)})
-            if not share_with_user:
-                raise HTTPException(
-                    status_code=404, detail="User to share with not found."
-                )
-            if share_with_user_id in note.get("shared", []):
-                raise HTTPException(
-                    status_code=400, detail="Note already shared with this user."
-                )
-
-    # Update the note
-    updated_note = Note(
-        id=id,
-        user_id=user_id,
-        title=note.title if note.title is not None else existing_note["title"],
-        content=note.content if note.content is not None else existing_note["content"],
-        created_at=existing_note["created_at"],
-        updated_at=datetime.now(timezone.utc),
-        shared=existing_note.get("shared", [])
-        + (note.shared if note.shared is not None else []),
-    )
-
-    notes.update_one(
-        {"_id": ObjectId(id)}, {"$set": updated_note.model_dump(exclude={"id"})}
-    )
+        # Check that every user to share with exists in one query
+        if await _missing_users(users, note.shared):
+            raise HTTPException(status_code=404, detail="User to share with not found.")
+        if set(note.shared) & set(existing_note.get("shared", [])):
+            raise HTTPException(
+                status_code=400, detail="Note already shared with this user."
+            )
+
+    # Update only the fields that changed
+    updated_at = datetime.now(timezone.utc)
+    update = {"$set": {"updated_at": updated_at}}
+    if note.title is not None:
+        update["$set"]["title"] = note.title
+    if note.content is not None:
+        content_update(await encode_content(note.content), update)
+    if note.shared:
+        update["$push"] = {"shared": {"$each": note.shared}}
+    # Reserved once the body is encoded, right before the write
+    seq, seq_at = await next_seq()
+    update["$set"].update(seq=seq, seq_at=seq_at)
+
+    # With If-Match, only write over the version the client has seen
+    query = {"_id": ObjectId(id)}
+    if if_match is not None:
+        query["updated_at"] = existing_note.get("updated_at")
+    try:
+        with seq_write(seq_at):
+            result = await notes.update_one(query, update)
+    except SeqWriteTimeout:
+        await delete_content_files([update["$set"].get("content_file")])
+        raise
+    if result.matched_count == 0:
+        # The new body was never referenced
+        await delete_content_files([update["$set"].get("content_file")])
+        if if_match is not None:
+            # The note was there a moment ago, so it changed in between
+            raise HTTPException(status_code=412, detail="Note has been modified.")
+        raise HTTPException(status_code=404, detail="Note not found.")
+    if note.content is not None:
+        await delete_content_files([existing_note.get("content_file")])
+    await note_indexes.refresh([id], users=note.shared or [])
 
+    response.headers["ETag"] = note_etag({"_id": id, "updated_at": updated_at})
     return {"message": "Note updated successfully."}
 
 
-# Endpoint to update notes in bulk
-@router.put("/bulk")
-def update_notes(
-    notes: list[NoteUpdate],
-    ids: list[str],
+# Endpoint to delete a specific note by ID
+@router.delete("/{id}")
+async def delete_note(
+    id: str,
+    if_match: Optional[str] = Header(None),
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    if len(notes) != len(ids):
-        raise HTTPException(
-            status_code=400, detail="Mismatch between notes and IDs count."
-        )
+    user_id = await verify_access(token, key)
+    notes = get_async_collection("notes")
+    query = {"_id": ObjectId(id), "user_id": user_id}
+
+    if if_match is not None:
+        version = await notes.find_one(query, VERSION_PROJECTION)
+        if not version:
+            raise HTTPException(status_code=404, detail="Note not found.")
+        check_if_match(if_match, version)
+        query["updated_at"] = version.get("updated_at")
+
+    deleted = await notes.find_one_and_delete(
+        query, {"user_id": 1, "shared": 1, "content_file": 1}
+    )
+    if deleted is None:
+        if if_match is not None:
+            # The note was there a moment ago, so it changed in between
+            raise HTTPException(status_code=412, detail="Note has been modified.")
+        raise HTTPException(status_code=404, detail="Note not found.")
+    await delete_content_files([deleted.get("content_file")])
+    seq, seq_at = await next_seq()
+    await add_tombstones(
+        ((id, member, seq) for member in [deleted["user_id"], *deleted.get("shared", [])]),
+        seq_at,
+    )
+    note_indexes.remove_note(id)
 
-    user_id = verify_access(token, key)
-    notes_collection = get_collection("notes")
-    users = get_collection("users")
-    time = datetime.now(timezone.utc)
+    return {"message": "Note deleted successfully."}
 
-    for i in range(len(ids)):
-        id = ids[i]
-        note = notes[i]
 
-        # Check if the note exists and belongs to the user
-        existing_note = notes_collection.find_one(
-            {"_id": ObjectId(id), "user_id": user_id}
-        )
-        if not existing_note:
-            raise HTTPException(status_code=404, detail=f"Note with ID {id} not found.")
+async def _missing_users(users, user_ids: list[str]) -> list[str]:
+    """
+    Return the ids in `user_ids` that are not existing users, in one query.
+    """
+    valid = {ObjectId(u) for u in user_ids if ObjectId.is_valid(u)}
+    found = {
+        str(doc["_id"])
+        async for doc in users.find({"_id": {"$in": list(valid)}}, {"_id": 1})
+    }
+    return [u for u in dict.fromkeys(user_ids) if u not in found]
 
-        if note.shared:
-            for share_with_user_id in note.shared:
-                # Check if the user to share with exists
-                share_with_user = users.find_one({"_id": ObjectId(share_with_user_id)})
-                if not share_with_user:
-                    raise HTTPException(
-                        status_code=404, detail="User to share with not found."
-                    )
-                if share_with_user_id in note.get("shared", []):
-                    raise HTTPException(
-                        status_code=400, detail="Note already shared with this user."
-                    )
-
-        # Update the note
-        updated_note = Note(
-            id=id,
-            user_id=user_id,
-            title=note.title if note.title is not None else existing_note["title"],
-            content=(
-                note.content if note.content is not None else existing_note["content"]
-            ),
-            created_at=existing_note["created_at"],
-            updated_at=time,
-            shared=existing_note.get("shared", [])
-            + (note.shared if note.shared is not None else []),
+
+async def _update_sharing(body: NoteShare, user_id: str, share: bool) -> dict:
+    """
+    Share or unshare every note in `body` with every user in it: one users
+    query, one notes query and one bulk_write however many of each there are.
+    """
+    notes = get_async_collection("notes")
+    users = get_async_collection("users")
+
+    missing = await _missing_users(users, body.user_ids)
+    if missing:
+        raise HTTPException(
+            status_code=404, detail=f"Users not found: {', '.join(missing)}"
         )
+    user_ids = list(dict.fromkeys(body.user_ids))
+    note_ids = list(dict.fromkeys(body.note_ids))
+
+    results = [{"id": id, "status": "updated"} for id in note_ids]
+
+    def fail(i: int, status: str, detail: str):
+        results[i]["status"] = status
+        results[i]["detail"] = detail
+
+    object_ids = {}
+    for i, id in enumerate(note_ids):
+        if ObjectId.is_valid(id):
+            object_ids[i] = ObjectId(id)
+        else:
+            fail(i, "invalid", "Invalid note ID.")
+    # Current members, so an unshare only tombstones users who lose access
+    owned = {
+        doc["_id"]: set(doc.get("shared", []))
+        async for doc in notes.find(
+            {"_id": {"$in": list(object_ids.values())}, "user_id": user_id},
+            {"_id": 1, "shared": 1},
+        )
+    }
 
-        notes_collection.update_one(
-            {"_id": ObjectId(id)}, {"$set": updated_note.model_dump(exclude={"id"})}
+    # Set semantics: sharing twice or unsharing a non-member is a no-op
+    if share:
+        change = {"$addToSet": {"shared": {"$each": user_ids}}}
+    else:
+        change = {"$pullAll": {"shared": user_ids}}
+    updated_at = datetime.now(timezone.utc)
+
+    last_seq, seq_at = await next_seq(len(note_ids))
+    first_seq = last_seq - len(note_ids) + 1
+    operations = []
+    op_items = []
+    for i, object_id in object_ids.items():
+        if object_id not in owned:
+            fail(i, "not_found", "Note not found.")
+            continue
+        update = {
+            **change,
+            "$set": {"updated_at": updated_at, "seq": first_seq + i, "seq_at": seq_at},
+        }
+        operations.append(UpdateOne({"_id": object_id, "user_id": user_id}, update))
+        op_items.append(i)
+
+    if operations:
+        try:
+            with seq_write(seq_at):
+                await notes.bulk_write(operations, ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details.get("writeErrors", []):
+                fail(op_items[error["index"]], "error", error.get("errmsg", "Write failed."))
+        if not share:
+            # Unshared users learn through /changes that the notes are gone
+            await add_tombstones(
+                (
+                    (note_ids[i], member, first_seq + i)
+                    for i in op_items
+                    if results[i]["status"] == "updated"
+                    for member in owned[object_ids[i]].intersection(user_ids)
+                ),
+                seq_at,
+            )
+        await note_indexes.refresh(
+            (note_ids[i] for i in op_items), users=user_ids if share else []
         )
 
-    return {"message": "Notes updated successfully."}
+    updated = sum(1 for r in results if r["status"] == "updated")
+    return {
+        "updated": updated,
+        "failed": len(results) - updated,
+        "results": results,
+    }
 
 
-# Endpoint to delete a specific note by ID
-@router.delete("/{id}")
-def delete_note(
-    id: str, token: str = Depends(oauth2_scheme), key: str = Depends(api_key_scheme)
+# Endpoint to share many notes with many users
+@router.post("/share", dependencies=[Depends(admission("bulk"))])
+async def share_notes(
+    body: NoteShare,
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
+    user_id = await verify_access(token, key)
+    return await _update_sharing(body, user_id, share=True)
 
-    result = notes.delete_one({"_id": ObjectId(id), "user_id": user_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Note not found.")
 
-    return {"message": "Note deleted successfully."}
+# Endpoint to unshare many notes from many users
+@router.post("/unshare", dependencies=[Depends(admission("bulk"))])
+async def unshare_notes(
+    body: NoteShare,
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
+):
+    user_id = await verify_access(token, key)
+    return await _update_sharing(body, user_id, share=False)
 
 
 # Endpoint to note between user
 @router.post("/share/{id}/{share_with_user_id}")
-def share_note(
+async def share_note(
     id: str,
     share_with_user_id: str,
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
-    users = get_collection("users")
+    user_id = await verify_access(token, key)
+    notes = get_async_collection("notes")
+    users = get_async_collection("users")
 
     # Check if the note exists and belongs to the user
-    note = notes.find_one({"_id": ObjectId(id), "user_id": user_id})
+    note = await notes.find_one({"_id": ObjectId(id), "user_id": user_id})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found.")
 
     # Check if the user to share with exists
-    share_with_user = users.find_one({"_id": ObjectId(share_with_user_id)})
+    share_with_user = await users.find_one({"_id": ObjectId(share_with_user_id)})
     if not share_with_user:
         raise HTTPException(status_code=404, detail="User to share with not found.")
 
@@ -260,30 +768,39 @@ def share_note(
             status_code=400, detail="Note already shared with this user."
         )
 
-    notes.update_one({"_id": ObjectId(id)}, {"$push": {"shared": share_with_user_id}})
+    seq, seq_at = await next_seq()
+    with seq_write(seq_at):
+        await notes.update_one(
+            {"_id": ObjectId(id)},
+            {
+                "$push": {"shared": share_with_user_id},
+                "$set": {"updated_at": datetime.now(timezone.utc), "seq": seq, "seq_at": seq_at},
+            },
+        )
+    await note_indexes.refresh([id], users=[share_with_user_id])
 
     return {"message": "Note shared successfully."}
 
 
 # Endpoint to remove sharing of note between user
 @router.post("/unshare/{id}/{share_with_user_id}")
-def unshare_note(
+async def unshare_note(
     id: str,
     share_with_user_id: str,
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    notes = get_collection("notes")
-    users = get_collection("users")
+    user_id = await verify_access(token, key)
+    notes = get_async_collection("notes")
+    users = get_async_collection("users")
 
     # Check if the note exists and belongs to the user
-    note = notes.find_one({"_id": ObjectId(id), "user_id": user_id})
+    note = await notes.find_one({"_id": ObjectId(id), "user_id": user_id})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found.")
 
     # Check if the user to unshare with exists
-    share_with_user = users.find_one({"_id": ObjectId(share_with_user_id)})
+    share_with_user = await users.find_one({"_id": ObjectId(share_with_user_id)})
     if not share_with_user:
         raise HTTPException(status_code=404, detail="User to unshare with not found.")
 
@@ -293,6 +810,16 @@ def unshare_note(
             status_code=400, detail="Note is not shared with this user."
         )
 
-    notes.update_one({"_id": ObjectId(id)}, {"$pull": {"shared": share_with_user_id}})
+    seq, seq_at = await next_seq()
+    with seq_write(seq_at):
+        await notes.update_one(
+            {"_id": ObjectId(id)},
+            {
+                "$pull": {"shared": share_with_user_id},
+                "$set": {"updated_at": datetime.now(timezone.utc), "seq": seq, "seq_at": seq_at},
+            },
+        )
+    await add_tombstones([(id, share_with_user_id, seq)], seq_at)
+    await note_indexes.refresh([id])
 
     return {"message": "Note unshared successfully."}
@@ -0,0 +1,148 @@
+import zlib
+from datetime import timezone
+from typing import AsyncIterator, Optional
+
+from bson import ObjectId
+
+from db import get_async_collection
+from db.content import CONTENT_FIELDS, decode_notes
+from notes.ingest import NoteImport, ndjson_lines
+from type.notes import NoteArchive
+from util import _get_env
+from util.response import dumps
+
+NOTES_EXPORT_BATCH_SIZE = int(
+    _get_env("NOTES_EXPORT_BATCH_SIZE", required=False, default="1000")
+)
+# Offloaded bodies are loaded together for this many notes at a time
+_DECODE_GROUP = 100
+# Output of one decompress call, bounds what a tiny gzip body can expand to
+_INFLATE_CHUNK = 1024 * 1024
+
+EXPORT_PROJECTION = {
+    "title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "shared": 1,
+    **dict.fromkeys(CONTENT_FIELDS, 1),
+}
+
+
+# ---------- Export ----------
+def _archive_line(note: dict) -> bytes:
+    line = {
+        "id": str(note["_id"]),
+        "title": note["title"],
+        "content": note["content"],
+        # MongoDB hands back naive UTC datetimes
+        "created_at": note["created_at"].replace(tzinfo=timezone.utc),
+        "updated_at": note["updated_at"] and note["updated_at"].replace(tzinfo=timezone.utc),
+        "shared": note.get("shared", []),
+    }
+    return dumps(line) + b"\n"
+
+
+async def export_lines(user_id: str) -> AsyncIterator[bytes]:
+    """
+    Yield every note the user owns as one NDJSON line, oldest first. The
+    order is the user_id_created_at index walked backwards, so the export
+    never sorts in memory.
+    """
+    cursor = (
+        get_async_collection("notes", read_only=True)
+        .find({"user_id": user_id}, EXPORT_PROJECTION)
+        .sort([("created_at", 1), ("_id", 1)])
+        .batch_size(NOTES_EXPORT_BATCH_SIZE)
+    )
+    group = []
+    async for note in cursor:
+        note.setdefault("updated_at", None)
+        group.append(note)
+        if len(group) >= _DECODE_GROUP:
+            for note in await decode_notes(group):
+                yield _archive_line(note)
+            group = []
+    for note in await decode_notes(group):
+        yield _archive_line(note)
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# ---------- Restore ----------
+async def gunzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Inflate a gzip (or zlib) stream, never more than _INFLATE_CHUNK at once.
+    Raises zlib.error on corrupt input.
+    """
+    decompressor = zlib.decompressobj(47)
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk, _INFLATE_CHUNK)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, _INFLATE_CHUNK)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+class NoteRestore(NoteImport):
+    """
+    Inserts exported notes for the caller with their original _id and
+    timestamps. Notes that already exist are reported, never overwritten,
+    so a restore can simply be rerun.
+    """
+
+    def parse(self, line: bytes) -> tuple[dict, str]:
+        note = NoteArchive.model_validate_json(line)
+        if not ObjectId.is_valid(note.id):
+            raise ValueError("id: Invalid note ID")
+        doc = {
+            "_id": ObjectId(note.id),
+            "user_id": self.user_id,
+            "title": note.title,
+            "created_at": note.created_at,
+            "updated_at": note.updated_at,
+            "shared": note.shared,
+        }
+        return doc, note.content
+
+    async def prepare(self, docs: list[dict]) -> None:
+        # Members who do not exist here, e.g. after a move to another
+        # deployment, are dropped rather than failing the note
+        members = {u for doc in docs for u in doc["shared"] if ObjectId.is_valid(u)}
+        found = set()
+        if members:
+            found = {
+                str(user["_id"])
+                async for user in get_async_collection("users").find(
+                    {"_id": {"$in": [ObjectId(u) for u in members]}}, {"_id": 1}
+                )
+            }
+        for doc in docs:
+            doc["shared"] = [
+                u for u in dict.fromkeys(doc["shared"]) if u in found and u != self.user_id
+            ]
+
+
+async def restore_notes(user_id: str, stream: AsyncIterator[bytes], gzip: bool) -> dict:
+    restore = NoteRestore(user_id)
+    if gzip:
+        stream = gunzip_stream(stream)
+    async for number, line in ndjson_lines(stream):
+        await restore.add(number, line)
+    await restore.flush()
+    return restore.result("Notes restored")
+
+
+def is_gzip(content_type: Optional[str], content_encoding: Optional[str]) -> bool:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return media_type in ("application/gzip", "application/x-gzip") or (
+        (content_encoding or "").strip().lower() == "gzip"
+    )
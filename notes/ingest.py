@@ -0,0 +1,195 @@
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from db import get_async_collection
+from db.changes import next_seq, seq_write
+from db.content import delete_content_files, encode_content
+from search.indexing import note_indexes
+from type.notes import Note, NoteCreate
+from util import _get_env
+
+# Notes written per insert_many; a chunk is also flushed once its lines
+# add up to NOTES_IMPORT_CHUNK_BYTES, well below the 48 MB batch limit
+NOTES_IMPORT_CHUNK_SIZE = int(
+    _get_env("NOTES_IMPORT_CHUNK_SIZE", required=False, default="500")
+)
+NOTES_IMPORT_CHUNK_BYTES = int(
+    _get_env("NOTES_IMPORT_CHUNK_BYTES", required=False, default="8388608")
+)
+# Longer lines are rejected without being buffered, like any invalid line
+NOTES_IMPORT_MAX_LINE_BYTES = int(
+    _get_env("NOTES_IMPORT_MAX_LINE_BYTES", required=False, default="16777216")
+)
+# Only this many per-line errors are reported, the rest are just counted
+NOTES_IMPORT_MAX_ERRORS = int(
+    _get_env("NOTES_IMPORT_MAX_ERRORS", required=False, default="1000")
+)
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/jsonlines")
+
+
+def is_ndjson(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in NDJSON_TYPES
+
+
+async def ndjson_lines(
+    stream: AsyncIterator[bytes], max_bytes: int = NOTES_IMPORT_MAX_LINE_BYTES
+) -> AsyncIterator[tuple[int, Optional[bytes]]]:
+    """
+    Split a byte stream into (line number, line) pairs. A line longer than
+    `max_bytes` is dropped while it streams past and yielded as None.
+    """
+    buffer = bytearray()
+    number = 0
+    too_long = False
+    async for chunk in stream:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not too_long:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_bytes:
+                        too_long = True
+                        buffer.clear()
+                break
+            number += 1
+            if not too_long:
+                buffer += chunk[start:end]
+            if too_long or len(buffer) > max_bytes:
+                yield number, None
+            else:
+                yield number, bytes(buffer)
+            too_long = False
+            buffer.clear()
+            start = end + 1
+    if buffer or too_long:
+        yield number + 1, None if too_long else bytes(buffer)
+
+
+def _describe(exc: ValidationError) -> str:
+    messages = []
+    for error in exc.errors(include_url=False):
+        location = ".".join(str(part) for part in error["loc"])
+        messages.append(f"{location}: {error['msg']}" if location else error["msg"])
+    return "; ".join(messages)
+
+
+class NoteImport:
+    """
+    Inserts the notes of one NDJSON upload chunk by chunk. Only the current
+    chunk and a bounded list of errors are ever held in memory.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.inserted = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+        self._docs: list[dict] = []
+        self._lines: list[int] = []
+        self._contents: list[str] = []
+        self._bytes = 0
+
+    def fail(self, line: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < NOTES_IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def parse(self, line: bytes) -> tuple[dict, str]:
+        """
+        Validate one line into a note document without its content, and
+        the content. Raises ValueError for a rejected line.
+        """
+        note = NoteCreate.model_validate_json(line)
+        doc = Note(
+            user_id=self.user_id,
+            title=note.title,
+            content=note.content,
+            created_at=datetime.now(timezone.utc),
+            updated_at=None,
+            shared=[],
+        ).model_dump(exclude={"id", "content"})
+        return doc, note.content
+
+    async def prepare(self, docs: list[dict]) -> None:
+        """
+        Adjust a chunk of documents right before it is inserted.
+        """
+
+    async def add(self, number: int, line: Optional[bytes]) -> None:
+        if line is None:
+            self.fail(number, f"Line is longer than {NOTES_IMPORT_MAX_LINE_BYTES} bytes.")
+            return
+        if not line.strip():
+            return
+        try:
+            doc, content = self.parse(line)
+        except ValidationError as exc:
+            self.fail(number, _describe(exc))
+            return
+        except ValueError as exc:
+            self.fail(number, str(exc))
+            return
+        doc.update(await encode_content(content))
+        self._docs.append(doc)
+        self._lines.append(number)
+        self._contents.append(content)
+        self._bytes += len(line)
+        if len(self._docs) >= NOTES_IMPORT_CHUNK_SIZE or self._bytes >= NOTES_IMPORT_CHUNK_BYTES:
+            await self.flush()
+
+    async def flush(self) -> None:
+        docs, lines, contents = self._docs, self._lines, self._contents
+        if not docs:
+            return
+        self._docs, self._lines, self._contents, self._bytes = [], [], [], 0
+
+        await self.prepare(docs)
+        # Reserved right before the insert, so /changes never has to wait
+        # on a number whose write is still being prepared
+        last_seq, seq_at = await next_seq(len(docs))
+        for seq, doc in enumerate(docs, start=last_seq - len(docs) + 1):
+            doc["seq"], doc["seq_at"] = seq, seq_at
+        failed = {}
+        try:
+            with seq_write(seq_at):
+                await get_async_collection("notes").insert_many(docs, ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details.get("writeErrors", []):
+                if error.get("code") == 11000:
+                    failed[error["index"]] = "Note already exists."
+                else:
+                    failed[error["index"]] = error.get("errmsg", "Write failed.")
+
+        for i, (doc, line, content) in enumerate(zip(docs, lines, contents)):
+            if i in failed:
+                self.fail(line, failed[i])
+                continue
+            self.inserted += 1
+            note_indexes.index_note({**doc, "content": content})
+        await delete_content_files(docs[i].get("content_file") for i in failed)
+
+    def result(self, message: str = "Notes imported") -> dict:
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "message": message,
+        }
+
+
+async def import_notes(user_id: str, stream: AsyncIterator[bytes]) -> dict:
+    """
+    Validate and insert an NDJSON body line by line. The body is only read
+    further once the previous chunk has been written, so a slow database
+    pushes back on the client instead of growing a buffer.
+    """
+    ingest = NoteImport(user_id)
+    async for number, line in ndjson_lines(stream):
+        await ingest.add(number, line)
+    await ingest.flush()
+    return ingest.result()
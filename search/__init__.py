@@ -1,9 +1,15 @@
-from fastapi import HTTPException
+from typing import Optional
+from fastapi import HTTPException, Query
 from fastapi import APIRouter
 from fastapi.params import Depends
 from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 
-from db import get_collection
+from db.content import decode_notes, preview_notes
+from search.backend import search_backend
+from search.suggest import suggest_index
+from util.fields import PREVIEW_MAX_CHARS, note_projection, parse_fields
+from util.ratelimit import admission
+from util.response import ORJSONResponse
 from util.security import verify_access
 
 
@@ -11,41 +17,65 @@ router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="search")
 api_key_scheme = APIKeyHeader(name="X-API-Key")
 
+# Fields of a search result when no fields= are requested
+SEARCH_FIELDS = ("id", "title", "content", "created_at", "updated_at", "shared")
+
 
 # Endpoint to search the notes
-@router.get("/")
-def search_notes(
+@router.get("/", dependencies=[Depends(admission("search"))])
+async def search_notes(
     q: str,
+    limit: int = Query(50, ge=1, le=200),
+    fields: Optional[str] = None,
+    preview: Optional[int] = Query(None, ge=1, le=PREVIEW_MAX_CHARS),
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
+    user_id = await verify_access(token, key)
 
     if not q.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty.")
 
-    notes = get_collection("notes")
-
-    cursor = notes.find(
-        {"user_id": user_id, "$text": {"$search": q}},
-        {"score": {"$meta": "textScore"}},
-    ).sort([("score", {"$meta": "textScore"})])
+    requested = parse_fields(fields)
+    notes = await search_backend.search(
+        user_id, q, limit, note_projection(requested, preview)
+    )
+    if preview:
+        await preview_notes(notes, preview)
+    else:
+        await decode_notes(notes)
 
+    selected = requested or SEARCH_FIELDS
     results = []
-    for note in cursor:
-        results.append(
-            {
-                "id": str(note["_id"]),
-                "title": note["title"],
-                "content": note["content"],
-                "created_at": note["created_at"],
-                "updated_at": note.get("updated_at"),
-                "shared": note.get("shared", []),
-            }
-        )
+    for note in notes:
+        note["id"] = str(note.pop("_id"))
+        note.setdefault("updated_at", None)
+        note.setdefault("shared", [])
+        results.append({name: note[name] for name in selected if name in note})
+
+    return ORJSONResponse(
+        {
+            "query": q,
+            "count": len(results),
+            "results": results,
+        }
+    )
+
+
+# Endpoint to suggest note titles for a typed prefix
+@router.get("/suggest", dependencies=[Depends(admission("search"))])
+async def suggest_titles(
+    prefix: str,
+    limit: int = Query(10, ge=1, le=50),
+    token: str = Depends(oauth2_scheme),
+    key: str = Depends(api_key_scheme),
+):
+    user_id = await verify_access(token, key)
+
+    if not prefix.strip():
+        raise HTTPException(status_code=400, detail="Prefix cannot be empty.")
 
     return {
-        "query": q,
-        "count": len(results),
-        "results": results,
+        "prefix": prefix,
+        "suggestions": await suggest_index.suggest(user_id, prefix, limit),
     }
@@ -0,0 +1,87 @@
+from typing import Optional
+
+from db import get_async_collection
+from util import _get_env
+
+SEARCH_BACKEND = _get_env("SEARCH_BACKEND", required=False, default="mongo")
+SEARCH_INDEX_PATH = _get_env(
+    "SEARCH_INDEX_PATH", required=False, default="search_index.bin"
+)
+
+
+class SearchBackend:
+    """
+    Interface every note search implementation provides.
+    The note write paths reach index_note/remove_note through
+    search.indexing.note_indexes so backends that keep their own index can
+    update it incrementally.
+    """
+
+    # Set by backends that keep their own index of note documents
+    incremental = False
+    # Note fields index_note reads
+    fields = ("user_id", "title", "shared", "content")
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def affected(self, note_ids: list[str], users: set[str]) -> list[str]:
+        """
+        The notes in `note_ids` whose re-read could change this index.
+        """
+        return note_ids
+
+    def index_note(self, note: dict) -> None:
+        pass
+
+    def remove_note(self, note_id: str) -> None:
+        pass
+
+    async def search(
+        self, user_id: str, q: str, limit: int, projection: Optional[dict] = None
+    ) -> list[dict]:
+        """
+        Return the raw note documents visible to `user_id` that match `q`,
+        best match first, each with a `score` field. `projection` limits
+        the fields loaded, as in find().
+        """
+        raise NotImplementedError
+
+
+class MongoTextBackend(SearchBackend):
+    """
+    Search through the MongoDB `$text` index on title and content.
+    """
+
+    async def search(
+        self, user_id: str, q: str, limit: int, projection: Optional[dict] = None
+    ) -> list[dict]:
+        notes = get_async_collection("notes", read_only=True)
+        cursor = (
+            notes.find(
+                {
+                    "$text": {"$search": q},
+                    "$or": [{"user_id": user_id}, {"shared": user_id}],
+                },
+                {**(projection or {}), "score": {"$meta": "textScore"}},
+            )
+            .sort([("score", {"$meta": "textScore"})])
+            .limit(limit)
+        )
+        return await cursor.to_list()
+
+
+def create_search_backend(name: str) -> SearchBackend:
+    if name == "bm25":
+        from search.bm25 import BM25Backend
+
+        return BM25Backend(SEARCH_INDEX_PATH, fallback=MongoTextBackend())
+    if name != "mongo":
+        raise ValueError(f"Unknown search backend: {name}")
+    return MongoTextBackend()
+
+
+search_backend = create_search_backend(SEARCH_BACKEND)
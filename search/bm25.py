@@ -0,0 +1,443 @@
+import asyncio
+import json
+import math
+import mmap
+import os
+import re
+import struct
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from db import get_async_collection
+from db.changes import NOTES_SYNC_SETTLE_MS, TOMBSTONE_TTL_SECONDS
+from db.content import CONTENT_FIELDS, decode_note
+from search.backend import SearchBackend
+from util import _get_env, logger
+
+SEARCH_SYNC_SECONDS = float(
+    _get_env("SEARCH_SYNC_SECONDS", required=False, default="10")
+)
+# A snapshot older than this may have missed tombstones that are gone by now
+TOMBSTONE_MAX_AGE = timedelta(seconds=TOMBSTONE_TTL_SECONDS) - timedelta(hours=1)
+
+TOKEN_RE = re.compile(r"\w+")
+QUERY_TOKEN_RE = re.compile(r"\w+\*?")
+# Title tokens are counted this many times, which weights title matches up
+TITLE_BOOST = 3
+MAX_PREFIX_EXPANSIONS = 50
+
+_MAGIC = b"BM25IDX1"
+_HEADER = struct.Struct("<8sQ")
+
+Postings = Union[array, memoryview]
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def _note_terms(note: dict) -> Counter:
+    return Counter(tokenize(note.get("title", "")) * TITLE_BOOST + tokenize(note.get("content", "")))
+
+
+def _note_users(note: dict) -> set[str]:
+    return {note["user_id"], *note.get("shared", [])}
+
+
+class BM25Index:
+    """
+    Inverted index over the notes one user can see, ranked with Okapi BM25.
+    Posting lists are pairs of uint32 arrays (doc numbers, term frequencies).
+    Removed documents are only marked dead and are dropped by compact().
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: list[Optional[str]] = []
+        self.doc_len: Postings = array("I")
+        self.doc_num: dict[str, int] = {}
+        self.postings: dict[str, tuple[Postings, Postings]] = {}
+        self.total_len = 0
+        self.dead = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_num)
+
+    def _writable(self, term: str) -> tuple[array, array]:
+        # Posting lists loaded from a snapshot are read-only views on the mmap
+        ids, tfs = self.postings.get(term, (None, None))
+        if not isinstance(ids, array):
+            ids = array("I", ids or [])
+            tfs = array("I", tfs or [])
+            self.postings[term] = (ids, tfs)
+        return ids, tfs
+
+    def add(self, note_id: str, terms: Counter) -> None:
+        self.remove(note_id)
+        if not isinstance(self.doc_len, array):
+            self.doc_len = array("I", self.doc_len)
+        num = len(self.doc_ids)
+        length = sum(terms.values())
+        self.doc_ids.append(note_id)
+        self.doc_len.append(length)
+        self.doc_num[note_id] = num
+        self.total_len += length
+        for term, tf in terms.items():
+            ids, tfs = self._writable(term)
+            ids.append(num)
+            tfs.append(tf)
+
+    def remove(self, note_id: str) -> None:
+        num = self.doc_num.pop(note_id, None)
+        if num is None:
+            return
+        self.doc_ids[num] = None
+        self.total_len -= self.doc_len[num]
+        self.dead += 1
+        if self.dead > 64 and self.dead * 4 > len(self.doc_ids):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Renumber live documents and drop dead entries from every posting list.
+        """
+        remap = {}
+        doc_ids: list[Optional[str]] = []
+        doc_len = array("I")
+        for num, note_id in enumerate(self.doc_ids):
+            if note_id is None:
+                continue
+            remap[num] = len(doc_ids)
+            doc_ids.append(note_id)
+            doc_len.append(self.doc_len[num])
+
+        postings = {}
+        for term, (ids, tfs) in self.postings.items():
+            new_ids = array("I")
+            new_tfs = array("I")
+            for num, tf in zip(ids, tfs):
+                if num in remap:
+                    new_ids.append(remap[num])
+                    new_tfs.append(tf)
+            if new_ids:
+                postings[term] = (new_ids, new_tfs)
+
+        self.doc_ids = doc_ids
+        self.doc_len = doc_len
+        self.doc_num = {note_id: num for num, note_id in enumerate(doc_ids)}
+        self.postings = postings
+        self.dead = 0
+
+    def _expand(self, token: str) -> list[str]:
+        if not token.endswith("*"):
+            return [token]
+        prefix = token[:-1]
+        matches = [term for term in self.postings if term.startswith(prefix)]
+        return matches[:MAX_PREFIX_EXPANSIONS]
+
+    def search(self, q: str, limit: int) -> list[tuple[str, float]]:
+        live = len(self.doc_num)
+        if not live:
+            return []
+        avgdl = self.total_len / live or 1.0
+        k1, b = self.k1, self.b
+        scores: dict[int, float] = defaultdict(float)
+
+        terms = set()
+        for token in QUERY_TOKEN_RE.findall(q.lower()):
+            terms.update(self._expand(token))
+
+        doc_ids = self.doc_ids
+        doc_len = self.doc_len
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            pairs = zip(*postings)
+            if self.dead:
+                # Dead entries must not count towards df, or idf goes negative
+                pairs = [(num, tf) for num, tf in pairs if doc_ids[num] is not None]
+            else:
+                pairs = list(pairs)
+            df = len(pairs)
+            if not df:
+                continue
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            for num, tf in pairs:
+                norm = k1 * (1 - b + b * doc_len[num] / avgdl)
+                scores[num] += idf * tf * (k1 + 1) / (tf + norm)
+
+        ranked = sorted(((score, num) for num, score in scores.items()), reverse=True)
+        return [(doc_ids[num], score) for score, num in ranked[:limit]]
+
+
+class BM25Store:
+    """
+    One BM25Index per user over every note the user owns or has been shared,
+    current up to change `seq`. Can be saved to and loaded from a single
+    memory-mapped snapshot file.
+    """
+
+    def __init__(self):
+        self.indexes: dict[str, BM25Index] = {}
+        self.note_users: dict[str, set[str]] = {}
+        self.seq = 0
+        self._mmap: Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        return len(self.note_users)
+
+    def add(self, note: dict) -> None:
+        note_id = str(note.get("_id", note.get("id")))
+        users = _note_users(note)
+        for user_id in self.note_users.get(note_id, set()) - users:
+            self.indexes[user_id].remove(note_id)
+        terms = _note_terms(note)
+        for user_id in users:
+            self.indexes.setdefault(user_id, BM25Index()).add(note_id, terms)
+        self.note_users[note_id] = users
+
+    def remove(self, note_id: str) -> None:
+        for user_id in self.note_users.pop(note_id, set()):
+            self.indexes[user_id].remove(note_id)
+
+    def search(self, user_id: str, q: str, limit: int) -> list[tuple[str, float]]:
+        index = self.indexes.get(user_id)
+        return index.search(q, limit) if index else []
+
+    # ---------- Snapshot persistence ----------
+    def save(self, path: str, saved_at: datetime) -> None:
+        header = {"saved_at": saved_at.isoformat(), "seq": self.seq, "users": {}}
+        body = bytearray()
+
+        def put(values: Postings) -> list[int]:
+            offset = len(body)
+            body.extend(array("I", values).tobytes())
+            return [offset, len(values)]
+
+        for user_id, index in self.indexes.items():
+            index.compact()
+            header["users"][user_id] = {
+                "doc_ids": index.doc_ids,
+                "doc_len": put(index.doc_len),
+                "total_len": index.total_len,
+                "postings": {
+                    term: [put(ids), put(tfs)] for term, (ids, tfs) in index.postings.items()
+                },
+            }
+
+        raw_header = json.dumps(header).encode()
+        # Keep the body 4-byte aligned so the arrays can be cast in place
+        padding = -(_HEADER.size + len(raw_header)) % 4
+        # Every worker saves on shutdown, so each writes its own temp file
+        # and the last complete snapshot to be renamed wins
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(raw_header) + padding))
+            f.write(raw_header + b" " * padding)
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> datetime:
+        """
+        Map a snapshot file and return the time it was saved. Posting lists
+        stay views on the mapping until a write copies them. Raises
+        ValueError for a file that is not a complete snapshot.
+        """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) < _HEADER.size:
+            raise ValueError(f"{path} is truncated")
+        magic, header_len = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a search index snapshot")
+        base = _HEADER.size + header_len
+        if base > len(mm):
+            raise ValueError(f"{path} is truncated")
+        header = json.loads(bytes(mm[_HEADER.size : base]))
+        view = memoryview(mm)
+
+        def get(ref: list[int]) -> memoryview:
+            offset, count = ref
+            start = base + offset
+            end = start + count * 4
+            if offset % 4 or end > len(mm):
+                raise ValueError(f"{path} is truncated")
+            return view[start:end].cast("I")
+
+        self.indexes = {}
+        self.note_users = defaultdict(set)
+        for user_id, data in header["users"].items():
+            index = BM25Index()
+            index.doc_ids = data["doc_ids"]
+            index.doc_len = get(data["doc_len"])
+            if len(index.doc_len) != len(index.doc_ids):
+                raise ValueError(f"{path} has mismatched document lengths")
+            index.doc_num = {note_id: num for num, note_id in enumerate(index.doc_ids)}
+            index.total_len = data["total_len"]
+            index.postings = {
+                term: (get(ids), get(tfs)) for term, (ids, tfs) in data["postings"].items()
+            }
+            self.indexes[user_id] = index
+            for note_id in index.doc_ids:
+                self.note_users[note_id].add(user_id)
+        self.note_users = dict(self.note_users)
+        self.seq = header["seq"]
+        self._mmap = mm
+        return datetime.fromisoformat(header["saved_at"])
+
+
+class BM25Backend(SearchBackend):
+    """
+    In-process BM25 search. The index is loaded from a snapshot (or built
+    from the notes collection) on startup, kept current by the note write
+    paths and by a periodic catch-up for writes made in other workers, and
+    saved back to the snapshot on shutdown. Until it is ready, searches go
+    to the fallback backend.
+    """
+
+    incremental = True
+    _PROJECTION = {
+        "_id": 1,
+        "user_id": 1,
+        "title": 1,
+        "shared": 1,
+        **dict.fromkeys(CONTENT_FIELDS, 1),
+        # Where the sync cursor may move to
+        "seq": 1,
+        "seq_at": 1,
+        "created_at": 1,
+        "updated_at": 1,
+    }
+
+    def __init__(self, path: str, fallback: SearchBackend):
+        self.path = path
+        self.fallback = fallback
+        self.store = BM25Store()
+        self.ready = False
+        self._synced_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="search-index")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.ready:
+            self.store.save(self.path, self._synced_at)
+            logger.info("Saved search index snapshot to %s", self.path)
+
+    async def _run(self) -> None:
+        if os.path.exists(self.path):
+            try:
+                self._synced_at = self.store.load(self.path)
+                logger.info("Loaded search index snapshot (%d notes)", len(self.store))
+                if self._synced_at < datetime.now(timezone.utc) - TOMBSTONE_MAX_AGE:
+                    # Tombstones for deletes since then are gone, so rebuild
+                    logger.info("Search index snapshot is older than the tombstones, rebuilding")
+                    self.store = BM25Store()
+                    self._synced_at = None
+            except (OSError, ValueError, KeyError, TypeError) as exc:
+                logger.warning("Ignoring unreadable search index snapshot: %s", exc)
+                self.store = BM25Store()
+                self._synced_at = None
+        while True:
+            try:
+                await self._sync()
+                self.ready = True
+            except PyMongoError as exc:
+                logger.warning("Search index sync failed: %s", exc)
+            await asyncio.sleep(SEARCH_SYNC_SECONDS)
+
+    async def _sync(self) -> None:
+        # Pick up changes made since the last sync, by this or any other
+        # worker, in change order like GET /notes/changes
+        started_at = datetime.now(timezone.utc)
+        horizon = started_at - timedelta(milliseconds=NOTES_SYNC_SETTLE_MS)
+        notes = get_async_collection("notes")
+        since = self.store.seq
+        # The cursor moves up to the last settled change, and stops short
+        # of any change whose write may have an earlier number in flight
+        last, pending = since, None
+
+        def seen(seq: Optional[int], settled_at: Optional[datetime]) -> None:
+            nonlocal last, pending
+            if seq is None:
+                return
+            if settled_at.replace(tzinfo=timezone.utc) > horizon:
+                pending = seq if pending is None else min(pending, seq)
+            else:
+                last = max(last, seq)
+
+        query = {"seq": {"$gt": since}} if self._synced_at is not None else {}
+        async for note in notes.find(query, self._PROJECTION).batch_size(1000):
+            seen(note.get("seq"), note.get("seq_at") or note.get("updated_at") or note["created_at"])
+            self.store.add(await decode_note(note))
+
+        if self._synced_at is not None:
+            # Deletes and unshares leave a tombstone; notes that are gone are
+            # dropped and the rest are re-added with their current members
+            cursor = get_async_collection("note_tombstones").find(
+                {"seq": {"$gt": since}}, {"note_id": 1, "seq": 1, "seq_at": 1, "deleted_at": 1}
+            )
+            touched = set()
+            async for doc in cursor:
+                seen(doc["seq"], doc.get("seq_at") or doc["deleted_at"])
+                touched.add(doc["note_id"])
+            ids = [ObjectId(id) for id in touched if id in self.store.note_users]
+            for i in range(0, len(ids), 1000):
+                batch = ids[i : i + 1000]
+                found = set()
+                async for note in notes.find({"_id": {"$in": batch}}, self._PROJECTION):
+                    found.add(str(note["_id"]))
+                    self.store.add(await decode_note(note))
+                for id in batch:
+                    if str(id) not in found:
+                        self.store.remove(str(id))
+        self.store.seq = last if pending is None else min(last, pending - 1)
+        self._synced_at = started_at
+
+    def index_note(self, note: dict) -> None:
+        self.store.add(note)
+
+    def remove_note(self, note_id: str) -> None:
+        self.store.remove(note_id)
+
+    async def search(
+        self, user_id: str, q: str, limit: int, projection: Optional[dict] = None
+    ) -> list[dict]:
+        if not self.ready:
+            return await self.fallback.search(user_id, q, limit, projection)
+
+        ranked = self.store.search(user_id, q, limit)
+        if not ranked:
+            return []
+        # The index can lag behind other workers, so access is re-checked here
+        cursor = get_async_collection("notes").find(
+            {
+                "_id": {"$in": [ObjectId(id) for id, _ in ranked]},
+                "$or": [{"user_id": user_id}, {"shared": user_id}],
+            },
+            projection,
+        )
+        notes = {str(note["_id"]): note async for note in cursor}
+        results = []
+        for note_id, score in ranked:
+            note = notes.get(note_id)
+            if note is None:
+                continue
+            note["score"] = score
+            results.append(note)
+        return results
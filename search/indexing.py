@@ -0,0 +1,69 @@
+from typing import Iterable
+
+from bson import ObjectId
+
+from db import get_async_collection
+from db.content import CONTENT_FIELDS, decode_notes
+from search.backend import search_backend
+from search.suggest import suggest_index
+
+
+class NoteIndexes:
+    """
+    Fans note writes out to every in-process index that tracks notes.
+    """
+
+    def __init__(self, *indexes):
+        self.indexes = [index for index in indexes if index.incremental]
+
+    def index_note(self, note: dict) -> None:
+        for index in self.indexes:
+            index.index_note(note)
+
+    def remove_note(self, note_id: str) -> None:
+        for index in self.indexes:
+            index.remove_note(note_id)
+
+    async def refresh(self, note_ids: Iterable[str], users: Iterable[str] = ()) -> None:
+        """
+        Re-read notes changed in place (bulk updates, sharing) and reindex
+        them. `users` are the users who may have just gained access. Only
+        notes some index is affected by are read, with only the fields
+        those indexes use, and content is only loaded if one of them
+        indexes it.
+        """
+        note_ids = list(dict.fromkeys(note_ids))
+        users = set(users)
+        wanted = {}
+        for index in self.indexes:
+            ids = index.affected(note_ids, users)
+            if ids:
+                wanted[index] = set(ids)
+        if not wanted:
+            return
+
+        fields = {field for index in wanted for field in index.fields}
+        projection = {"_id": 1, **{field: 1 for field in fields if field != "content"}}
+        if "content" in fields:
+            projection.update(dict.fromkeys(CONTENT_FIELDS, 1))
+        ids = set().union(*wanted.values())
+        cursor = get_async_collection("notes").find(
+            {"_id": {"$in": [ObjectId(id) for id in ids]}}, projection
+        )
+        found = await cursor.to_list()
+        if "content" in fields:
+            found = await decode_notes(found)
+
+        for note in found:
+            note_id = str(note["_id"])
+            ids.discard(note_id)
+            for index, index_ids in wanted.items():
+                if note_id in index_ids:
+                    index.index_note(note)
+        for note_id in ids:
+            for index, index_ids in wanted.items():
+                if note_id in index_ids:
+                    index.remove_note(note_id)
+
+
+note_indexes = NoteIndexes(search_backend, suggest_index)
@@ -0,0 +1,152 @@
+from bisect import bisect_left, insort
+from typing import Optional
+
+from db import get_async_collection
+from search.bm25 import tokenize
+from util import _get_env
+from util.cache import TTLCache
+
+SUGGEST_CACHE_USERS = int(
+    _get_env("SUGGEST_CACHE_USERS", required=False, default="10000")
+)
+# Loaded title indexes are rebuilt after this long to pick up other workers' writes
+SUGGEST_CACHE_TTL_SECONDS = float(
+    _get_env("SUGGEST_CACHE_TTL_SECONDS", required=False, default="300")
+)
+
+
+def _keys(title: str) -> list[str]:
+    # Edge keys: the title from each word onwards, so "my apple pie" can be
+    # found by "my", "apple" or "pie"
+    words = tokenize(title)
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class TitleIndex:
+    """
+    Sorted list of title keys for one user; a prefix lookup is a bisect
+    followed by a scan of the matching range.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.keys: list[tuple[str, int, str]] = []
+        self.titles: dict[str, str] = {}
+
+    def __contains__(self, note_id: str) -> bool:
+        return note_id in self.titles
+
+    def add(self, note_id: str, title: str) -> None:
+        if self.titles.get(note_id) == title:
+            return
+        self.remove(note_id)
+        self.titles[note_id] = title
+        for position, key in enumerate(_keys(title)):
+            insort(self.keys, (key, position, note_id))
+
+    def remove(self, note_id: str) -> None:
+        title = self.titles.pop(note_id, None)
+        if title is None:
+            return
+        for position, key in enumerate(_keys(title)):
+            i = bisect_left(self.keys, (key, position, note_id))
+            if i < len(self.keys) and self.keys[i] == (key, position, note_id):
+                del self.keys[i]
+
+    def suggest(self, prefix: str, limit: int) -> list[dict]:
+        prefix = " ".join(tokenize(prefix))
+        if not prefix:
+            return []
+        best: dict[str, int] = {}
+        i = bisect_left(self.keys, (prefix,))
+        while i < len(self.keys) and self.keys[i][0].startswith(prefix):
+            _, position, note_id = self.keys[i]
+            best[note_id] = min(position, best.get(note_id, position))
+            i += 1
+        # Titles that start with the prefix rank above mid-title word matches
+        ranked = sorted(best.items(), key=lambda item: (item[1], self.titles[item[0]].lower()))
+        return [{"id": note_id, "title": self.titles[note_id]} for note_id, _ in ranked[:limit]]
+
+
+class SuggestIndex:
+    """
+    Per-user title indexes for type-ahead, loaded on a user's first request
+    and kept current by the note write paths. Only titles are ever loaded.
+    """
+
+    incremental = True
+    # Note fields index_note reads
+    fields = ("user_id", "title", "shared")
+
+    def __init__(self):
+        self.cache: TTLCache[str, TitleIndex] = TTLCache(
+            max_size=SUGGEST_CACHE_USERS, ttl=SUGGEST_CACHE_TTL_SECONDS
+        )
+        # Note id -> users whose loaded index holds the note. Users whose
+        # index has since been evicted are skipped and pruned lazily.
+        self.note_users: dict[str, set[str]] = {}
+
+    async def _load(self, user_id: str) -> TitleIndex:
+        index = TitleIndex(user_id)
+        cursor = get_async_collection("notes", read_only=True).find(
+            {"$or": [{"user_id": user_id}, {"shared": user_id}]}, {"title": 1}
+        )
+        async for note in cursor:
+            note_id = str(note["_id"])
+            index.add(note_id, note["title"])
+            self.note_users.setdefault(note_id, set()).add(user_id)
+        self.cache.set(user_id, index)
+        self._prune()
+        return index
+
+    def _prune(self) -> None:
+        # Evicted indexes leave their notes behind; rebuild once they dominate
+        loaded = self.cache.values()
+        if len(self.note_users) <= 2 * sum(len(index.titles) for index in loaded) + 1000:
+            return
+        note_users: dict[str, set[str]] = {}
+        for index in loaded:
+            for note_id in index.titles:
+                note_users.setdefault(note_id, set()).add(index.user_id)
+        self.note_users = note_users
+
+    async def suggest(self, user_id: str, prefix: str, limit: int) -> list[dict]:
+        index: Optional[TitleIndex] = self.cache.get(user_id)
+        if index is None:
+            index = await self._load(user_id)
+        return index.suggest(prefix, limit)
+
+    def affected(self, note_ids: list[str], users: set[str]) -> list[str]:
+        """
+        The notes in `note_ids` whose refresh can change a loaded index:
+        all of them if one of `users`, who may have just gained access, has
+        a loaded index, otherwise those some loaded index already holds.
+        """
+        if any(self.cache.peek(user_id) is not None for user_id in users):
+            return note_ids
+        return [note_id for note_id in note_ids if note_id in self.note_users]
+
+    def index_note(self, note: dict) -> None:
+        note_id = str(note.get("_id", note.get("id")))
+        users = {note["user_id"], *note.get("shared", [])}
+        self._drop(note_id, keep=users)
+        holders = set()
+        for user_id in users:
+            index = self.cache.peek(user_id)
+            if index is not None:
+                index.add(note_id, note["title"])
+                holders.add(user_id)
+        if holders:
+            self.note_users[note_id] = holders
+
+    def remove_note(self, note_id: str) -> None:
+        self._drop(note_id, keep=set())
+
+    def _drop(self, note_id: str, keep: set[str]) -> None:
+        for user_id in self.note_users.pop(note_id, set()) - keep:
+            index = self.cache.peek(user_id)
+            if index is not None:
+                index.remove(note_id)
+
+
+suggest_index = SuggestIndex()
@@ -0,0 +1,80 @@
+import argparse
+import importlib.util
+import os
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from util import _get_env, logger  # noqa: E402  (reads the .env loaded above)
+
+SERVER_HOST = _get_env("SERVER_HOST", required=False, default="0.0.0.0")
+SERVER_PORT = int(_get_env("PORT", required=False, default="8000"))
+# 0 starts one worker per CPU
+WEB_CONCURRENCY = int(_get_env("WEB_CONCURRENCY", required=False, default="0"))
+SERVER_BACKLOG = int(_get_env("SERVER_BACKLOG", required=False, default="2048"))
+SERVER_KEEPALIVE_SECONDS = int(
+    _get_env("SERVER_KEEPALIVE_SECONDS", required=False, default="5")
+)
+# Connections per worker beyond which new requests get a 503; 0 means no limit
+SERVER_LIMIT_CONCURRENCY = int(
+    _get_env("SERVER_LIMIT_CONCURRENCY", required=False, default="0")
+)
+# How long a stopping worker waits for in-flight requests and event streams
+SERVER_GRACEFUL_SECONDS = int(
+    _get_env("SERVER_GRACEFUL_SECONDS", required=False, default="30")
+)
+SERVER_ACCESS_LOG = _get_env("SERVER_ACCESS_LOG", required=False, default="false")
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _workers(requested: int) -> int:
+    return requested if requested > 0 else os.cpu_count() or 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the API with production settings.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument(
+        "--workers", type=int, default=WEB_CONCURRENCY, help="0 for one per CPU"
+    )
+    parser.add_argument("--backlog", type=int, default=SERVER_BACKLOG)
+    parser.add_argument("--keep-alive", type=int, default=SERVER_KEEPALIVE_SECONDS)
+    parser.add_argument("--limit-concurrency", type=int, default=SERVER_LIMIT_CONCURRENCY)
+    parser.add_argument("--graceful-timeout", type=int, default=SERVER_GRACEFUL_SECONDS)
+    args = parser.parse_args()
+
+    workers = _workers(args.workers)
+    loop = "uvloop" if _installed("uvloop") else "asyncio"
+    http = "httptools" if _installed("httptools") else "h11"
+    logger.info(
+        "Starting %d worker(s) on %s:%d with %s and %s", workers, args.host, args.port, loop, http
+    )
+
+    # Each worker is a fresh process that imports main:app itself, and its
+    # lifespan opens the MongoDB client, so no connection crosses a fork.
+    # On SIGTERM uvicorn stops accepting, lets in-flight requests finish for
+    # up to graceful-timeout seconds, then runs the lifespan shutdown.
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.limit_concurrency or None,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        access_log=SERVER_ACCESS_LOG.lower() == "true",
+        log_level="info",
+    )
+
+
+if __name__ == "__main__":
+    main()
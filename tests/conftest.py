@@ -0,0 +1,8 @@
+import os
+
+# db reads these on import; the unit tests never open a connection
+os.environ.setdefault("DB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "notes_test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
@@ -0,0 +1,170 @@
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+
+from search.bm25 import BM25Index, BM25Store
+
+
+def _note(id, user_id, title, content="", shared=()):
+    return {"_id": id, "user_id": user_id, "title": title, "content": content, "shared": list(shared)}
+
+
+def _ids(results):
+    return [note_id for note_id, _ in results]
+
+
+# ---------- BM25Index ----------
+def test_index_ranks_by_term_frequency():
+    index = BM25Index()
+    index.add("a", Counter({"apple": 1, "pie": 1}))
+    index.add("b", Counter({"apple": 3}))
+    index.add("c", Counter({"banana": 1}))
+
+    assert _ids(index.search("apple", 10)) == ["b", "a"]
+    assert _ids(index.search("apple", 1)) == ["b"]
+    assert index.search("cherry", 10) == []
+
+
+def test_index_prefix_query():
+    index = BM25Index()
+    index.add("a", Counter({"application": 1}))
+    index.add("b", Counter({"apple": 1}))
+    index.add("c", Counter({"banana": 1}))
+
+    assert sorted(_ids(index.search("app*", 10))) == ["a", "b"]
+
+
+def test_index_add_replaces_and_remove_hides():
+    index = BM25Index()
+    index.add("a", Counter({"apple": 1}))
+    index.add("a", Counter({"banana": 1}))
+
+    assert index.search("apple", 10) == []
+    assert _ids(index.search("banana", 10)) == ["a"]
+    assert len(index) == 1
+
+    index.remove("a")
+    index.remove("missing")
+    assert index.search("banana", 10) == []
+    assert len(index) == 0
+    assert index.total_len == 0
+
+
+def test_index_compact_keeps_results():
+    index = BM25Index()
+    for i in range(10):
+        index.add(str(i), Counter({"common": 1, f"word{i}": i + 1}))
+    for i in range(0, 10, 2):
+        index.remove(str(i))
+    before = index.search("common word7", 10)
+
+    index.compact()
+
+    assert index.dead == 0
+    assert index.doc_ids == ["1", "3", "5", "7", "9"]
+    assert index.search("common word7", 10) == pytest.approx(before)
+    assert _ids(before) == ["7", "1", "3", "5", "9"]
+
+
+def test_index_compacts_itself_once_mostly_dead():
+    index = BM25Index()
+    for i in range(200):
+        index.add(str(i), Counter({"term": 1}))
+    for i in range(100):
+        index.remove(str(i))
+
+    assert index.dead < 100
+    assert len(index.doc_ids) < 200
+    assert sorted(_ids(index.search("term", 200)), key=int) == [str(i) for i in range(100, 200)]
+
+
+# ---------- BM25Store ----------
+def test_store_follows_sharing():
+    store = BM25Store()
+    store.add(_note("n1", "alice", "Groceries", "milk eggs", shared=["bob"]))
+
+    assert _ids(store.search("alice", "milk", 10)) == ["n1"]
+    assert _ids(store.search("bob", "milk", 10)) == ["n1"]
+
+    store.add(_note("n1", "alice", "Groceries", "milk eggs"))
+    assert store.search("bob", "milk", 10) == []
+    assert _ids(store.search("alice", "milk", 10)) == ["n1"]
+
+    store.remove("n1")
+    assert store.search("alice", "milk", 10) == []
+    assert len(store) == 0
+
+
+def test_store_title_matches_rank_first():
+    store = BM25Store()
+    store.add(_note("body", "alice", "Shopping", "remember the budget meeting"))
+    store.add(_note("title", "alice", "Budget", "numbers for next year"))
+
+    assert _ids(store.search("alice", "budget", 10)) == ["title", "body"]
+
+
+# ---------- Snapshots ----------
+def _filled_store():
+    store = BM25Store()
+    store.add(_note("n1", "alice", "Apple pie", "flour butter apples", shared=["bob"]))
+    store.add(_note("n2", "alice", "Banana bread", "bananas flour"))
+    store.add(_note("n3", "bob", "Apple crumble", "apples oats"))
+    store.add(_note("n4", "bob", "Scratch", "to be removed"))
+    store.remove("n4")
+    return store
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "index.bin")
+    saved_at = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    original = _filled_store()
+    original.save(path, saved_at)
+
+    loaded = BM25Store()
+    assert loaded.load(path) == saved_at
+    assert loaded.note_users == {"n1": {"alice", "bob"}, "n2": {"alice"}, "n3": {"bob"}}
+    for user_id in ("alice", "bob"):
+        for q in ("apple", "flour", "appl*", "removed"):
+            assert loaded.search(user_id, q, 10) == original.search(user_id, q, 10)
+    assert os.listdir(tmp_path) == ["index.bin"]
+
+
+def test_snapshot_is_writable_after_load(tmp_path):
+    path = str(tmp_path / "index.bin")
+    _filled_store().save(path, datetime.now(timezone.utc))
+    store = BM25Store()
+    store.load(path)
+
+    store.add(_note("n5", "alice", "Apple tart", "apples"))
+    store.remove("n2")
+
+    assert sorted(_ids(store.search("alice", "apple", 10))) == ["n1", "n5"]
+    assert store.search("alice", "banana", 10) == []
+
+    store.save(path, datetime.now(timezone.utc))
+    reloaded = BM25Store()
+    reloaded.load(path)
+    assert sorted(_ids(reloaded.search("alice", "apple", 10))) == ["n1", "n5"]
+
+
+@pytest.mark.parametrize("keep", [0, 10, 20, -1])
+def test_truncated_snapshot_raises_value_error(tmp_path, keep):
+    path = str(tmp_path / "index.bin")
+    _filled_store().save(path, datetime.now(timezone.utc))
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:keep])
+
+    with pytest.raises(ValueError):
+        BM25Store().load(path)
+
+
+def test_foreign_file_raises_value_error(tmp_path):
+    path = tmp_path / "index.bin"
+    path.write_bytes(b"not an index at all, just some bytes")
+
+    with pytest.raises(ValueError):
+        BM25Store().load(str(path))
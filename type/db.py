@@ -1,3 +1,6 @@
 from typing import Literal
 
-CollectionName = Literal["users", "notes","blacklist_tokens"]
+CollectionName = Literal[
+    "users", "notes", "blacklisted_tokens", "counters", "note_tombstones",
+    "rate_limits", "notes_archive", "archived_shares", "job_leases",
+]
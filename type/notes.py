@@ -1,6 +1,7 @@
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel
+from functools import lru_cache
+from typing import Literal, Optional
+from pydantic import BaseModel, Field, TypeAdapter, create_model
 
 
 class Note(BaseModel):
@@ -12,11 +13,55 @@ class Note(BaseModel):
     updated_at: Optional[datetime] = None
     shared: list[str] = []
 
+NoteAdapter = TypeAdapter(Note)
+NoteListAdapter = TypeAdapter(list[Note])
+
+NOTE_FIELDS = tuple(Note.model_fields)
+
+@lru_cache(maxsize=None)
+def note_fields_list_adapter(fields: tuple[str, ...]) -> TypeAdapter:
+    """
+    TypeAdapter for a list of notes that only carry `fields`, a subset of
+    NOTE_FIELDS in their declared order.
+    """
+    model = create_model(
+        "NoteFields",
+        **{name: (Note.model_fields[name].annotation, Note.model_fields[name]) for name in fields},
+    )
+    return TypeAdapter(list[model])
+
+class NoteChange(BaseModel):
+    type: Literal["upsert", "delete"]
+    id: str
+    seq: int
+    note: Optional[Note] = None
+
+class NoteChanges(BaseModel):
+    changes: list[NoteChange]
+    next: str
+    has_more: bool
+
+NoteChangesAdapter = TypeAdapter(NoteChanges)
+
 class NoteCreate(BaseModel):
     title: str
     content: str
 
+NoteCreateListAdapter = TypeAdapter(list[NoteCreate])
+
+class NoteArchive(BaseModel):
+    id: str
+    title: str
+    content: str
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    shared: list[str] = []
+
 class NoteUpdate(BaseModel):
     title: Optional[str] = None
     content: Optional[str] = None
-    shared: Optional[list[str]] = None
\ No newline at end of file
+    shared: Optional[list[str]] = None
+
+class NoteShare(BaseModel):
+    note_ids: list[str] = Field(min_length=1, max_length=1000)
+    user_ids: list[str] = Field(min_length=1, max_length=1000)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, TypeAdapter
 from datetime import datetime
 from typing import Optional
 
@@ -21,6 +21,8 @@ class GetUser(BaseModel):
     last_login: Optional[datetime] = None
     key: str
 
+GetUserAdapter = TypeAdapter(GetUser)
+
 class SignUp(BaseModel):
     email: EmailStr
     password: str
@@ -4,11 +4,19 @@ from bson import ObjectId
 from fastapi import APIRouter
 from fastapi.params import Depends
 from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
-from type.user import GetUser, UpdateUser
+from type.user import GetUserAdapter, Login, UpdateUser
 
-from db import get_collection
+from db import get_async_collection
+from db.archive import reactivate_user as reactivate
 from util.key import generate_user_key
-from util.security import hash_password, verify_access
+from util.ratelimit import admission
+from util.response import model_response
+from util.security import (
+    hash_password_async,
+    invalidate_user_access,
+    verify_access,
+    verify_hash_async,
+)
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="notes")
@@ -17,34 +25,33 @@ api_key_scheme = APIKeyHeader(name="X-API-Key")
 
 # Endpoint to fetch a specific user data by ID
 @router.get("")
-def get_user(
+async def get_user(
     token: str = Depends(oauth2_scheme), key: str = Depends(api_key_scheme)
 ):
-    user_id = verify_access(token, key)
-    users = get_collection("users")
-    user = users.find_one({"_id": ObjectId(user_id)})
+    user_id = await verify_access(token, key)
+    users = get_async_collection("users")
+    user = await users.find_one({"_id": ObjectId(user_id)})
     if not user or not user.get("is_active", True):
         raise HTTPException(status_code=404, detail="User not found.")
-    user["id"] = str(user["_id"])
-    del user["_id"]
-    return GetUser(**user)
+    user["id"] = str(user.pop("_id"))
+    return model_response(GetUserAdapter, user)
 
 
 # Endpoint to update a specific user data by ID
 @router.put("")
-def update_user(
+async def update_user(
     updated_user: UpdateUser,
     token: str = Depends(oauth2_scheme),
     key: str = Depends(api_key_scheme),
 ):
-    user_id = verify_access(token, key)
-    users = get_collection("users")
+    user_id = await verify_access(token, key)
+    users = get_async_collection("users")
     if updated_user.email:
-        existing_user = users.find_one({"email": updated_user.email})
+        existing_user = await users.find_one({"email": updated_user.email}, {"_id": 1})
         if existing_user and str(existing_user["_id"]) != user_id:
             raise HTTPException(status_code=400, detail="Email already exists.")
     if updated_user.password:
-        updated_user.password = hash_password(updated_user.password)
+        updated_user.password = await hash_password_async(updated_user.password)
         
     update_user = updated_user.model_dump(exclude_unset=True)
     update_user["updated_at"] = datetime.now(timezone.utc)
@@ -53,25 +60,48 @@ def update_user(
     if not update_user:
         raise HTTPException(status_code=400, detail="No fields to update.")
     
-    result = users.update_one(
+    result = await users.update_one(
         {"_id": ObjectId(user_id)},
         {"$set": update_user},
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found.")
+    invalidate_user_access(user_id)
     return {"message": "User updated successfully."}
 
 
 # Endpoint to delete a specific user data by ID
 @router.delete("")
-def delete_user(
+async def delete_user(
     token: str = Depends(oauth2_scheme), key: str = Depends(api_key_scheme)
 ):
-    user_id = verify_access(token, key)
-    users = get_collection("users")
-    result = users.update_one(
-        {"_id": ObjectId(user_id)}, {"$set": {"is_active": False}}
+    user_id = await verify_access(token, key)
+    users = get_async_collection("users")
+    result = await users.update_one(
+        {"_id": ObjectId(user_id)},
+        {"$set": {"is_active": False, "deactivated_at": datetime.now(timezone.utc)}},
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found.")
+    invalidate_user_access(user_id)
     return {"message": "User deleted successfully."}
+
+
+# Endpoint to reactivate a deleted user and restore their notes
+@router.post("/reactivate", dependencies=[Depends(admission("auth"))])
+async def reactivate_user(user: Login, key: str = Depends(api_key_scheme)):
+    users = get_async_collection("users")
+    raw_user = await users.find_one({"email": user.email, "key": key})
+    if not raw_user:
+        raise HTTPException(status_code=401, detail="Invalid credentials.")
+    if not await verify_hash_async(user.password, raw_user["password_hash"]):
+        raise HTTPException(status_code=401, detail="Invalid credentials.")
+    if raw_user.get("is_active", True) and "archive_state" not in raw_user:
+        raise HTTPException(status_code=400, detail="User is already active.")
+
+    # Archived notes come back through the archiver, a batch at a time
+    restoring = await reactivate(str(raw_user["_id"]))
+    return {
+        "message": "User reactivated successfully.",
+        "restoring": restoring,
+    }
@@ -0,0 +1,62 @@
+from hashlib import blake2b
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+
+# Enough to compute an ETag without loading the note body
+VERSION_PROJECTION = {"_id": 1, "created_at": 1, "updated_at": 1}
+
+
+def _version(note: dict) -> str:
+    stamp = note.get("updated_at") or note["created_at"]
+    # MongoDB keeps milliseconds and hands back naive UTC datetimes
+    return stamp.replace(tzinfo=None).isoformat(timespec="milliseconds")
+
+
+def note_etag(note: dict) -> str:
+    """
+    Strong ETag of a single note. Every write to a note sets updated_at.
+    """
+    id = note.get("_id", note.get("id"))
+    digest = blake2b(f"{id}:{_version(note)}".encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def list_etag(notes: Iterable[dict], page: str = "") -> str:
+    """
+    Strong ETag of an ordered list of notes, built from their versions only.
+    `page` identifies the request parameters that shape the response body.
+    """
+    digest = blake2b(page.encode(), digest_size=16)
+    for note in notes:
+        digest.update(f"{note['_id']}:{_version(note)};".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """
+    Check an If-None-Match (weak comparison) or If-Match (strong) header.
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def check_if_match(header: Optional[str], note: Optional[dict]) -> None:
+    """
+    Raise 412 when an If-Match header does not match the current note.
+    """
+    if header is None:
+        return
+    if note is None or not etag_matches(header, note_etag(note), weak=False):
+        raise HTTPException(status_code=412, detail="Note has been modified.")
@@ -0,0 +1,62 @@
+from typing import Optional
+
+from fastapi import HTTPException
+
+from type.notes import NOTE_FIELDS
+
+# Longest preview a client may ask for, in characters
+PREVIEW_MAX_CHARS = 10000
+
+
+def parse_fields(fields: Optional[str]) -> Optional[tuple[str, ...]]:
+    """
+    Turn a `fields=title,created_at` parameter into the requested note
+    fields in NOTE_FIELDS order, always including id. None means all.
+    """
+    if fields is None or not fields.strip():
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = sorted(requested - set(NOTE_FIELDS))
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(NOTE_FIELDS)}.",
+        )
+    requested.add("id")
+    return tuple(name for name in NOTE_FIELDS if name in requested)
+
+
+def note_projection(
+    fields: Optional[tuple[str, ...]], preview: Optional[int] = None
+) -> Optional[dict]:
+    """
+    MongoDB projection for `fields`, or None for whole documents. With a
+    `preview`, plain text content is cut to that many code points by the
+    server; compressed or offloaded content comes back encoded and is cut
+    by db.content.preview_notes.
+
+    created_at and updated_at are always included because keyset cursors
+    and ETags are built from them.
+    """
+    if fields is None and not preview:
+        return None
+    projection = {"created_at": 1, "updated_at": 1}
+    for name in fields or NOTE_FIELDS:
+        if name == "id":
+            continue
+        if name != "content":
+            projection[name] = 1
+            continue
+        projection["content_codec"] = 1
+        projection["content_file"] = 1
+        if preview:
+            projection["content"] = {
+                "$cond": [
+                    {"$eq": [{"$type": "$content"}, "string"]},
+                    {"$substrCP": ["$content", 0, preview]},
+                    "$content",
+                ]
+            }
+        else:
+            projection["content"] = 1
+    return projection
@@ -1,10 +1,13 @@
 from datetime import datetime, timedelta, timezone
+from uuid import uuid4
 from jose import jwt, JWTError, ExpiredSignatureError
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 
-from db import get_collection
+from db import get_async_collection
 from util import _get_env
+from util.metrics import timed
+from util.revocation import revocations
 
 SECRET_KEY = _get_env("SECRET_KEY")
 ALGORITHM = _get_env("ALGORITHM")
@@ -16,21 +19,19 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid4().hex})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_access_token(token: str):
-    if get_collection("blacklisted_tokens").find_one({"token": token}):
-        raise HTTPException(status_code=401, detail="Token has been revoked")
+async def verify_access_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with timed("jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str | None = payload.get("sub")
         if user_id is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload"
             )
-        return payload
     except ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired"
@@ -40,3 +41,31 @@ def verify_access_token(token: str):
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
 
+    jti = payload.get("jti")
+    if jti is not None:
+        revoked = revocations.is_revoked(jti)
+    else:
+        # Tokens issued before jti existed are still checked the old way
+        revoked = await get_async_collection("blacklisted_tokens").find_one(
+            {"token": token}
+        )
+    if revoked:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return payload
+
+
+async def revoke_access_token(payload: dict, token: str) -> None:
+    revoked_at = datetime.now(timezone.utc)
+    expires_at = datetime.fromtimestamp(payload["exp"], timezone.utc)
+    record = {
+        "user_id": payload["sub"],
+        "revoked_at": revoked_at,
+        "expires_at": expires_at,
+    }
+    if payload.get("jti"):
+        record["jti"] = payload["jti"]
+        revocations.add(payload["jti"], expires_at)
+    else:
+        record["token"] = token
+    await get_async_collection("blacklisted_tokens").insert_one(record)
+
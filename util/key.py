@@ -1,9 +1,9 @@
-from db import db
+from db import get_async_collection
 import secrets
 
-def key_validiator(provided_key: str) -> bool:
-    db_keys = db["users"]
-    key_entry = db_keys.find_one({"key": provided_key})
+async def key_validiator(provided_key: str) -> bool:
+    db_keys = get_async_collection("users")
+    key_entry = await db_keys.find_one({"key": provided_key}, {"_id": 1})
     return key_entry is not None
 
 def generate_user_key() -> str:
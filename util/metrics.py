@@ -0,0 +1,293 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from pymongo import monitoring
+
+from util import _get_env, logger
+
+SLOW_QUERY_MS = float(_get_env("SLOW_QUERY_MS", required=False, default="100"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with fixed buckets, one series per label set.
+    """
+
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            # Per-bucket counts (non-cumulative), then sum and count
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(key, le=bound)} {cumulative}")
+            lines.append(f'{self.name}_bucket{_labels(key, le="+Inf")} {count}')
+            lines.append(f"{self.name}_sum{_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._series: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, value: float = 1, **labels) -> None:
+        self._series[tuple(sorted(labels.items()))] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: tuple, **extra) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+# ---------- Metrics registry ----------
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.")
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route.")
+request_db_commands = Histogram(
+    "http_request_mongo_commands", "MongoDB commands issued per HTTP request.", COUNT_BUCKETS
+)
+request_db_time = Histogram(
+    "http_request_mongo_seconds", "Time spent in MongoDB commands per HTTP request."
+)
+mongo_commands = Counter("mongo_commands_total", "MongoDB commands by name and outcome.")
+mongo_latency = Histogram("mongo_command_duration_seconds", "MongoDB command latency by name.")
+section_latency = Histogram(
+    "app_section_duration_seconds", "Time spent in instrumented sections (bcrypt, jwt, auth)."
+)
+admission_decisions = Counter(
+    "admission_decisions_total", "Admission control decisions by route class and outcome."
+)
+
+# Extra gauges registered by other modules, rendered as name -> value
+_gauges: dict[str, tuple[str, Callable[[], dict]]] = {}
+
+
+def register_gauges(name: str, help: str, collect: Callable[[], dict]) -> None:
+    """
+    Register a gauge family read at scrape time. `collect` returns
+    {kind: value}, rendered as name{kind="..."} value.
+    """
+    _gauges[name] = (help, collect)
+
+
+def render() -> str:
+    lines = []
+    for metric in (http_requests, http_latency, request_db_commands, request_db_time,
+                   mongo_commands, mongo_latency, section_latency, admission_decisions):
+        lines += metric.render()
+    for name, (help, collect) in _gauges.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        for kind, value in collect().items():
+            lines.append(f"{name}{_labels((('kind', kind),))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Route templates ----------
+# Route objects of included routers may only know their path relative to the
+# router, so the prefix they were included with is recorded here.
+_route_paths: dict[int, str] = {}
+
+
+def register_routes(routes: list, prefix: str) -> None:
+    for route in routes:
+        _route_paths[id(route)] = prefix + getattr(route, "path", "")
+
+
+def route_path(route) -> str:
+    if route is None:
+        return "unmatched"
+    return _route_paths.get(id(route)) or getattr(route, "path", "unmatched")
+
+
+# ---------- Per-request attribution ----------
+class RequestStats:
+    __slots__ = ("scope", "db_commands", "db_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.db_commands = 0
+        self.db_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def timed(section: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        section_latency.observe(time.perf_counter() - start, section=section)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency and MongoDB usage per route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            # Use the route template so /notes/{id} is one series, not one per id
+            path = route_path(scope.get("route"))
+            method = scope["method"]
+            http_requests.inc(method=method, route=path, status=status)
+            http_latency.observe(elapsed, method=method, route=path)
+            request_db_commands.observe(stats.db_commands, method=method, route=path)
+            request_db_time.observe(stats.db_seconds, method=method, route=path)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Counts and times every MongoDB command, attributes it to the current
+    request and logs commands slower than SLOW_QUERY_MS.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def _finish(self, event, outcome: str) -> None:
+        seconds = event.duration_micros / 1_000_000
+        mongo_commands.inc(command=event.command_name, outcome=outcome)
+        mongo_latency.observe(seconds, command=event.command_name)
+        stats = _current.get()
+        if stats is not None:
+            stats.db_commands += 1
+            stats.db_seconds += seconds
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            route = stats.scope.get("route") if stats is not None else None
+            logger.warning(
+                "Slow MongoDB command: %s on %s took %.1f ms (route: %s)",
+                event.command_name,
+                event.database_name,
+                seconds * 1000,
+                route_path(route),
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, "success")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, "failure")
+
+
+command_metrics = CommandMetrics()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Tracks connection pool state across every server the client talks to.
+    """
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+        self.pools_cleared = 0
+
+    def stats(self) -> dict:
+        return {
+            "open": self.open,
+            "checked_out": self.checked_out,
+            "waiting": self.waiting,
+            "checkout_failures": self.checkout_failures,
+            "pools_cleared": self.pools_cleared,
+        }
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        self.pools_cleared += 1
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        self.open += 1
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self.open -= 1
+
+    def connection_check_out_started(self, event) -> None:
+        self.waiting += 1
+
+    def connection_check_out_failed(self, event) -> None:
+        self.waiting -= 1
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event) -> None:
+        self.waiting -= 1
+        self.checked_out += 1
+
+    def connection_checked_in(self, event) -> None:
+        self.checked_out -= 1
+
+
+pool_metrics = PoolMetrics()
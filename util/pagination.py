@@ -0,0 +1,47 @@
+import base64
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+
+
+def encode_cursor(created_at: datetime, id: ObjectId) -> str:
+    raw = f"{created_at.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), ObjectId(id)
+    except (ValueError, InvalidId, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+
+
+def keyset_after(cursor: str) -> dict:
+    """
+    Filter matching everything after `cursor` in (created_at, _id) descending order.
+    """
+    created_at, id = decode_cursor(cursor)
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": id}},
+        ]
+    }
+
+
+def encode_change_cursor(seq: int, issued_at: datetime) -> str:
+    raw = f"{seq}|{issued_at.isoformat()}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_change_cursor(cursor: str) -> tuple[int, datetime]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        seq, issued_at = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return int(seq), datetime.fromisoformat(issued_at)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid sync cursor.")
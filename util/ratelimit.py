@@ -0,0 +1,169 @@
+import math
+import time
+
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+from db import get_async_collection
+from util import _get_env
+from util.cache import TTLCache
+from util.metrics import admission_decisions
+
+# "memory" keeps buckets per worker, "mongo" shares them across workers
+RATE_LIMIT_STORE = _get_env("RATE_LIMIT_STORE", required=False, default="memory")
+RATE_LIMIT_KEYS = int(_get_env("RATE_LIMIT_KEYS", required=False, default="100000"))
+
+# Route class -> (default rate "requests/seconds", default concurrency cap)
+_DEFAULTS = {
+    "auth": ("10/60", "16"),
+    "bulk": ("30/60", "8"),
+    "search": ("120/60", "32"),
+}
+# Route classes used before the client has a validated API key; any key
+# they send is unchecked, so their buckets are keyed by client address
+_ADDRESS_KEYED = {"auth"}
+
+
+class RoutePolicy:
+    """
+    Limits for one route class: a token bucket per client key, refilled at
+    `capacity` tokens per `period` seconds, and a cap on requests in flight
+    in this worker. Either limit is off when zero.
+    """
+
+    def __init__(self, name: str, rate: str, concurrency: int):
+        self.name = name
+        self.capacity, self.period = 0, 0.0
+        if rate and rate != "0":
+            capacity, period = rate.split("/")
+            self.capacity, self.period = int(capacity), float(period)
+            if self.capacity < 0 or self.period <= 0:
+                raise ValueError(f"Invalid rate limit for {name}: {rate}")
+        self.concurrency = concurrency
+        self.in_flight = 0
+
+    @property
+    def refill(self) -> float:
+        return self.capacity / self.period
+
+    @classmethod
+    def from_env(cls, name: str) -> "RoutePolicy":
+        rate, concurrency = _DEFAULTS[name]
+        key = name.upper()
+        return cls(
+            name,
+            _get_env(f"RATE_LIMIT_{key}", required=False, default=rate),
+            int(_get_env(f"CONCURRENCY_LIMIT_{key}", required=False, default=concurrency)),
+        )
+
+
+class MemoryBuckets:
+    def __init__(self):
+        # A bucket left alone for a whole period is full again, so the
+        # entry can expire after that long without changing any decision
+        self.buckets: dict[str, TTLCache] = {}
+
+    async def take(self, policy: RoutePolicy, key: str) -> float:
+        """
+        Take one token. Returns 0 when allowed, else seconds until a token.
+        """
+        cache = self.buckets.get(policy.name)
+        if cache is None:
+            cache = self.buckets[policy.name] = TTLCache(RATE_LIMIT_KEYS, policy.period)
+        now = time.monotonic()
+        tokens, last = cache.get(key) or (policy.capacity, now)
+        tokens = min(policy.capacity, tokens + (now - last) * policy.refill)
+        if tokens < 1:
+            cache.set(key, (tokens, now))
+            return (1 - tokens) / policy.refill
+        cache.set(key, (tokens - 1, now))
+        return 0.0
+
+
+class MongoBuckets:
+    """
+    Buckets in the rate_limits collection, updated atomically with one
+    pipeline update per request so every worker shares them.
+    """
+
+    async def take(self, policy: RoutePolicy, key: str) -> float:
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {
+            "$min": [
+                policy.capacity,
+                {"$add": [{"$ifNull": ["$tokens", policy.capacity]}, {"$multiply": [elapsed, policy.refill]}]},
+            ]
+        }
+        bucket = await get_async_collection("rate_limits").find_one_and_update(
+            {"_id": f"{policy.name}:{key}"},
+            [
+                {"$set": {"tokens": refilled, "updated_at": "$$NOW"}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {
+                    "$set": {
+                        "tokens": {
+                            "$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]
+                        }
+                    }
+                },
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / policy.refill
+
+
+if RATE_LIMIT_STORE not in ("memory", "mongo"):
+    raise ValueError(f"Unknown RATE_LIMIT_STORE: {RATE_LIMIT_STORE}")
+_buckets = MongoBuckets() if RATE_LIMIT_STORE == "mongo" else MemoryBuckets()
+policies = {name: RoutePolicy.from_env(name) for name in _DEFAULTS}
+
+
+def in_flight() -> dict:
+    return {name: policy.in_flight for name, policy in policies.items()}
+
+
+def _client_key(request: Request, route_class: str) -> str:
+    key = request.headers.get("x-api-key")
+    if key and route_class not in _ADDRESS_KEYED:
+        return key
+    return request.client.host if request.client else "anonymous"
+
+
+def admission(route_class: str):
+    """
+    Dependency that admits a request of `route_class` or rejects it before
+    any work is done: 429 when the client's bucket is empty, 503 when the
+    worker already runs as many of these requests as it should.
+    """
+    policy = policies[route_class]
+
+    async def admit(request: Request):
+        # Shed first, so a request turned away for load costs no token
+        if policy.concurrency and policy.in_flight >= policy.concurrency:
+            admission_decisions.inc(route_class=route_class, outcome="shed")
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+        # Counted in flight before the bucket is read, which may wait on Mongo
+        policy.in_flight += 1
+        try:
+            if policy.capacity:
+                wait = await _buckets.take(policy, _client_key(request, route_class))
+                if wait:
+                    admission_decisions.inc(route_class=route_class, outcome="rate_limited")
+                    raise HTTPException(
+                        status_code=429,
+                        detail="Rate limit exceeded.",
+                        headers={"Retry-After": str(math.ceil(wait))},
+                    )
+            admission_decisions.inc(route_class=route_class, outcome="admitted")
+            yield
+        finally:
+            policy.in_flight -= 1
+
+    return admit
@@ -0,0 +1,39 @@
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    # orjson encodes datetime natively and ObjectId through _default
+    return orjson.dumps(content, default=_default)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response encoded with orjson. Return it directly from an endpoint
+    to skip FastAPI's jsonable_encoder pass over large payloads.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def model_response(adapter: TypeAdapter, value: Any, **kwargs) -> Response:
+    """
+    Validate `value` in one batch through a cached TypeAdapter and encode it
+    with pydantic-core's JSON serializer.
+    """
+    return Response(
+        adapter.dump_json(adapter.validate_python(value)),
+        media_type="application/json",
+        **kwargs,
+    )
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo.errors import PyMongoError
+
+from db import get_async_collection
+from util import _get_env, logger
+
+REVOCATION_SYNC_SECONDS = float(
+    _get_env("REVOCATION_SYNC_SECONDS", required=False, default="5")
+)
+# Rows written by other workers may land with a slightly older revoked_at than
+# the newest row already seen, so every sync re-reads a small overlap window.
+REVOCATION_SYNC_OVERLAP = timedelta(seconds=30)
+
+
+def _to_timestamp(value) -> float:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+class RevocationSet:
+    """
+    In-memory set of revoked token ids (jti), each kept only until the
+    token's own expiry. Lookups never touch the database; the set is filled
+    from `blacklisted_tokens` on startup and refreshed by a background sync.
+    """
+
+    def __init__(self):
+        self._revoked: dict[str, float] = {}
+        self._last_seen: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, jti: str, expires_at) -> None:
+        exp = _to_timestamp(expires_at)
+        if exp <= time.time():
+            return
+        self._revoked[jti] = exp
+
+    def is_revoked(self, jti: str) -> bool:
+        exp = self._revoked.get(jti)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            # The token is expired anyway, no need to remember it
+            self._revoked.pop(jti, None)
+            return False
+        return True
+
+    def prune(self) -> None:
+        now = time.time()
+        for jti in [j for j, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[jti]
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    # ---------- Sync with the blacklisted_tokens collection ----------
+    async def sync(self) -> None:
+        query = {"jti": {"$exists": True}, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+        if self._last_seen is not None:
+            query["revoked_at"] = {"$gte": self._last_seen - REVOCATION_SYNC_OVERLAP}
+
+        cursor = get_async_collection("blacklisted_tokens").find(
+            query, {"_id": 0, "jti": 1, "expires_at": 1, "revoked_at": 1}
+        )
+        async for row in cursor:
+            self.add(row["jti"], row["expires_at"])
+            revoked_at = row.get("revoked_at")
+            if revoked_at and (self._last_seen is None or revoked_at > self._last_seen):
+                self._last_seen = revoked_at
+        self.prune()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(REVOCATION_SYNC_SECONDS)
+            try:
+                await self.sync()
+            except PyMongoError as exc:
+                logger.warning("Revocation sync failed: %s", exc)
+
+    async def start(self) -> None:
+        await self.sync()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="revocation-sync")
+        logger.info("Loaded %d revoked tokens", len(self))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+revocations = RevocationSet()
@@ -1,26 +1,78 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from fastapi import HTTPException
 from bson import ObjectId
 from passlib.context import CryptContext
 
-from db import get_collection
+from db import get_async_collection
+from util import _get_env
+from util.cache import TTLCache
 from util.jwt import verify_access_token
 from util.key import key_validiator
+from util.metrics import timed
+from util.revocation import revocations
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor; each step doubles the cost. Pick it with
+# `python -m bench.hashing --target-ms 250` on production hardware.
+BCRYPT_ROUNDS = int(_get_env("BCRYPT_ROUNDS", required=False, default="12"))
+if not 4 <= BCRYPT_ROUNDS <= 31:
+    raise ValueError(f"BCRYPT_ROUNDS must be between 4 and 31, got {BCRYPT_ROUNDS}")
 
+# min and max pin the cost, so needs_update flags hashes made with any other
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
-def verify_access(
+# ---------- Authentication context cache ----------
+# Maps (token, key) -> (user_id, jti) so repeat requests skip the token and key
+# lookups. The jti is kept so a revocation synced from another worker still
+# applies to contexts that are already cached.
+AUTH_CACHE_SIZE = int(_get_env("AUTH_CACHE_SIZE", required=False, default="10000"))
+AUTH_CACHE_TTL_SECONDS = float(
+    _get_env("AUTH_CACHE_TTL_SECONDS", required=False, default="60")
+)
+
+auth_cache: TTLCache[tuple[str, str], tuple[str, Optional[str]]] = TTLCache(
+    max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS
+)
+
+
+def invalidate_access(token: str, key: str) -> None:
+    auth_cache.pop((token, key))
+
+
+def invalidate_user_access(user_id: str) -> None:
+    auth_cache.discard_if(lambda context: context[0] == user_id)
+
+
+async def verify_access(
     token: str, key: str
 ):
-    payload = verify_access_token(token)
-    if not payload or not key_validiator(key):
-        raise HTTPException(status_code=401, detail="Unauthorized access.")
-    
-    users = get_collection("users")
-    user_id = payload["sub"]
-    if not users.find_one({"_id": ObjectId(user_id), "key": key}):
-        raise HTTPException(status_code=401, detail="Invalid API key for user.")
-    
+    context = auth_cache.get((token, key))
+    if context is not None:
+        user_id, jti = context
+        if jti is None or not revocations.is_revoked(jti):
+            return user_id
+        auth_cache.pop((token, key))
+
+    with timed("verify_access_miss"):
+        payload = await verify_access_token(token)
+        if not payload or not await key_validiator(key):
+            raise HTTPException(status_code=401, detail="Unauthorized access.")
+
+        users = get_async_collection("users")
+        user_id = payload["sub"]
+        if not await users.find_one({"_id": ObjectId(user_id), "key": key}, {"_id": 1}):
+            raise HTTPException(status_code=401, detail="Invalid API key for user.")
+
+    # Never keep a context alive past the token's own expiry
+    auth_cache.set((token, key), (user_id, payload.get("jti")), expires_at=payload.get("exp"))
     return user_id
 
 def hash_password(password: str) -> str:
@@ -29,3 +81,68 @@ def hash_password(password: str) -> str:
 
 def verify_hash(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
+
+
+def verify_and_rehash(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Verify a password and, when its hash needs_update (a different cost
+    than BCRYPT_ROUNDS), also return a new hash to store in its place.
+    """
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, None
+    if pwd_context.needs_update(hashed_password):
+        return True, pwd_context.hash(plain_password)
+    return True, None
+
+
+# ---------- Hashing worker pool ----------
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event
+# loop. Work beyond the pool size plus the queue limit is rejected with a 503.
+HASH_POOL_SIZE = int(
+    _get_env("HASH_POOL_SIZE", required=False, default=str(os.cpu_count() or 1))
+)
+HASH_QUEUE_LIMIT = int(_get_env("HASH_QUEUE_LIMIT", required=False, default="32"))
+
+_hash_executor = ThreadPoolExecutor(
+    max_workers=HASH_POOL_SIZE, thread_name_prefix="hash"
+)
+_hash_pending = 0
+
+
+async def _run_hash_work(func, *args):
+    global _hash_pending
+    if _hash_pending >= HASH_POOL_SIZE + HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, try again later.",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        with timed("bcrypt"):
+            return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hash_work(hash_password, password)
+
+
+async def verify_hash_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hash_work(verify_hash, plain_password, hashed_password)
+
+
+async def verify_and_rehash_async(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, Optional[str]]:
+    return await _run_hash_work(verify_and_rehash, plain_password, hashed_password)
+
+
+def hash_pending() -> int:
+    return _hash_pending
+
+
+def shutdown_hash_pool() -> None:
+    _hash_executor.shutdown(wait=False, cancel_futures=True)